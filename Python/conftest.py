@@ -0,0 +1,2 @@
+# hidapi_test*.py are scripts talking to a real DP100, not pytest modules
+collect_ignore = ["hidapi_test.py", "hidapi_test_n.py"]
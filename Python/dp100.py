@@ -30,78 +30,145 @@
 
 import threading
 import os
+import signal
+import argparse
 
-from time import gmtime, strftime, localtime, sleep
+from time import perf_counter
 import queue
 from dp100_gui import start_gui, GUI
 from dp100_functions import DP100Functions
+from dp100_session import DP100Session
+from dp100_discovery import DeviceDiscovery
+from dp100_daemon import run_daemon, DEFAULT_SOCKET
+from dp100_profile import StageProfiler
+from dp100_emulator import DP100Emulator
+from dp100_replay import HIDRecorder, HIDReplay
+from dp100_protocol import VENDOR_ID, PRODUCT_ID
 
 def main_loop(dp, flags_2_main, queue_2_main, queue_2_gui, queue_2_png):
-    """Main loop for handling device communication and GUI updates"""
+    """Main loop: blocks on the command queue and runs every GUI command
+       as soon as it arrives. Telemetry keeps its own schedule in the
+       acquisition thread."""
     try:
-        dp.create_csv_file()
+        dp.start_log()
         while not flags_2_main["flag_exit"].is_set():  # Check the exit flag
-            if flags_2_main["flag_connect"].is_set():
-                dev = dp.get_device_info()
-                print(f"device_info: {dev}")
-                basic = dp.get_basic_info()
-                print(f"basic_info: {basic}")
-                profiles = dp.get_profiles()
-                print(f"profiles: {profiles}")
-                active_profile = dp.get_active_profile_info(True)
-                print(f"get_active_profile_info: {active_profile}")
-                flags_2_main["flag_connect"].clear()
-            if flags_2_main["flag_get_basic_info"].is_set():
-                basic = dp.get_basic_info()
-                queue_2_png.put("CREATE_PNG") # Signal the PNG creation thread to generate a PNG
-                queue_2_gui.put("PNG:\nplotted\n")
-                # do not stop this by clearing the flag!
-            if flags_2_main["flag_on_off"].is_set():
-                dp.on_off()
-                flags_2_main["flag_on_off"].clear()
-            if flags_2_main["flag_change_profile"].is_set():
-                dp.change_profile(int(change_profile[0]),
-                                  float(change_profile[1]),
-                                  float(change_profile[2]))
-                profiles = dp.get_profiles()
-                flags_2_main["flag_change_profile"].clear()
-            if flags_2_main["flag_activate_profile"].is_set():
-                dp.off()
-                dp.activate_profile(int(activate_profile))
-                active_profile = dp.get_active_profile_info(True)
-                flags_2_main["flag_activate_profile"].clear()
-            if flags_2_main["flag_reset_png"].is_set():
-                dp.create_csv_file()
-                flags_2_main["flag_reset_png"].clear()
             try:
-                change_profile = ""
-                activate_profile = ""
-                message = queue_2_main.get_nowait()
-                message = message.split('\n')
-                print(f"Message from GUI: {message}")
-                if message[0] == "change_profile:":
-                    change_profile = message[1:4]
-                    flags_2_main["flag_change_profile"].set()
-                if message[0] == "activate_profile:":
-                    activate_profile = message[1]
-                    flags_2_main["flag_activate_profile"].set()
+                message = queue_2_main.get(timeout=1.0)  # exit flag is checked once a second
             except queue.Empty:
-                pass
-            sleep(1)  # Prevent busy-waiting
+                continue
+            start = perf_counter()
+            message = message.split('\n')
+            print(f"Message from GUI: {message}")
+            try:
+                if message[0] == "connect:":
+                    dev = dp.get_device_info()
+                    print(f"device_info: {dev}")
+                    basic = dp.get_basic_info()
+                    print(f"basic_info: {basic}")
+                    profiles = dp.get_profiles()
+                    print(f"profiles: {profiles}")
+                    active_profile = dp.get_active_profile_info(True)
+                    print(f"get_active_profile_info: {active_profile}")
+                    flags_2_main["flag_get_basic_info"].set()  # start telemetry
+                elif message[0] == "on_off:":
+                    dp.on_off()
+                elif message[0] == "change_profile:":
+                    # one read of all profiles, write and verify only if it differs
+                    dp.sync_profiles({int(message[1]): {"vo_set": float(message[2]),
+                                                        "io_set": float(message[3])}})
+                elif message[0] == "activate_profile:":
+                    dp.off()
+                    dp.activate_profile(int(message[1]))
+                    active_profile = dp.get_active_profile_info(True, cached=True)
+                elif message[0] == "reset_png:":
+                    dp.start_log()
+                elif message[0] == "save_png:":
+                    queue_2_png.put("CREATE_PNG")  # PNG export on demand
+                elif message[0] == "exit:":
+                    break
+            except (ValueError, IndexError) as e:
+                print(f"Invalid command {message}: {e}")
+            print(f"{message[0]} done in {(perf_counter()-start)*1000:.1f} ms")
     except KeyboardInterrupt:
         print("Keyboard interrupt by user")
     print("Main loop terminated.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Alientek DP100 manipulator")
+    parser.add_argument("--rate", type=float, default=1.0, metavar="HZ",
+                        help="basic info samples per second, 0 for as fast as possible (default 1)")
+    parser.add_argument("--log-format", choices=("bin", "csv"), default="bin",
+                        help="binary capture (default, export with dp100_capture.py) or CSV log")
+    parser.add_argument("--segment-minutes", type=float, metavar="MIN",
+                        help="split the binary capture into segments of MIN minutes")
+    parser.add_argument("--segment-mb", type=float, metavar="MB",
+                        help="split the binary capture into segments of at most MB megabytes")
+    parser.add_argument("--keep-segments", type=int, metavar="N",
+                        help="keep only the newest N capture segments (default all)")
+    parser.add_argument("--decimation", choices=("minmax", "lttb", "none"), default="minmax",
+                        help="reduce long series to the plot width before drawing (default minmax)")
+    parser.add_argument("--png-interval", type=float, default=0.0, metavar="S",
+                        help="also save the chart as PNG every S seconds (default 0: on demand only)")
+    parser.add_argument("--fsync", action="store_true",
+                        help="fsync the CSV file on every flush (safer, slower)")
+    parser.add_argument("--daemon", nargs="?", const=DEFAULT_SOCKET, metavar="SOCKET",
+                        help=f"run headless and serve clients on a Unix socket (default {DEFAULT_SOCKET})")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="write Prometheus metrics to FILE every 10 s (textfile collector)")
+    parser.add_argument("--profile", nargs="?", type=float, const=10.0, metavar="S",
+                        help="print a per-stage timing breakdown every S seconds (default 10)")
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="run all threads under cProfile and write the pstats to FILE")
+    parser.add_argument("--serial", metavar="SN",
+                        help="HID serial number of the DP100 to use (see dp100_multi.py --list)")
+    parser.add_argument("--path", metavar="PATH",
+                        help="HID path of the DP100 to use, default the first one found")
+    parser.add_argument("--emulator", action="store_true",
+                        help="use the software DP100 emulator instead of the USB device")
+    parser.add_argument("--emulator-latency", type=float, default=0.002, metavar="S",
+                        help="emulator response time in seconds (default 0.002)")
+    parser.add_argument("--emulator-load", type=float, default=10.0, metavar="OHM",
+                        help="emulator load resistance in ohm (default 10)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record every HID request/response pair to FILE (see dp100_replay.py)")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="answer from a recorded transfer FILE instead of the USB device")
+    parser.add_argument("--replay-speed", type=float, default=1.0, metavar="X",
+                        help="replay X times faster than recorded, 0 for as fast as possible (default 1)")
+    parser.add_argument("--replay-loop", action="store_true",
+                        help="start the replay again at the end of the recording")
+    return parser.parse_args()
+
+def acquisition_loop(dp, flags_2_main, queue_2_gui, queue_2_png, rate,
+                     gui_interval=0.2, png_interval=None):
+    """Pull basic info samples from the stream and feed log, GUI and PNG.
+       The GUI and the PNG thread get updates at their own (slower) pace,
+       a PNG only every png_interval seconds (None: on demand only), the
+       live chart reads the ring buffer by itself."""
+    while not flags_2_main["flag_exit"].is_set():
+        # wait until connected, the flag is never cleared
+        if not flags_2_main["flag_get_basic_info"].wait(0.5):
+            continue
+        next_gui = next_png = 0.0
+        for timestamp, basic in dp.stream_basic_info(rate, flags_2_main["flag_exit"]):
+            dp.record_sample(timestamp, basic)
+            if timestamp >= next_gui:
+                with dp.profiler.stage("gui_text"):
+                    queue_2_gui.put(dp.basic_info_text(basic))
+                next_gui = timestamp + gui_interval
+            if png_interval and timestamp >= next_png:
+                queue_2_png.put("CREATE_PNG") # Signal the PNG creation thread to generate a PNG
+                next_png = timestamp + png_interval
+    print("Acquisition loop terminated.")
+
 def main():
     """Setup and start main loop"""
+    args = parse_args()
     print("Program started! Version 3.0 (2025)")
-    flags_2_main = {"flag_connect": 0,
-                    "flag_get_basic_info" : 1,
-                    "flag_on_off" : 2,
-                    "flag_change_profile" : 3,
-                    "flag_activate_profile" : 4,
-                    "flag_reset_png" : 5,
-                    "flag_exit" : 6}
+    flags_2_main = {"flag_get_basic_info" : 0,
+                    "flag_exit" : 1}
     for f in flags_2_main:
         flags_2_main[f] = threading.Event()
 
@@ -109,16 +176,75 @@ def main():
     queue_2_gui = queue.Queue()   # Queue for communication from main_loop to GUI
     queue_2_png = queue.Queue()   # Queue for communication from main_loop to PNG creation thread
 
-    dp = DP100Functions(queue_2_main, queue_2_gui, queue_2_png)
+    path = args.path.encode() if args.path else None
+    discovery = None
+    recorder = replay = None
+    if args.replay:
+        replay = HIDReplay(args.replay, args.replay_speed, args.replay_loop)
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=replay)
+    elif args.emulator:
+        emulator = DP100Emulator(latency=args.emulator_latency, load_ohm=args.emulator_load)
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=emulator)
+    else:                        # watch for the DP100 being unplugged and plugged in
+        discovery = DeviceDiscovery(VENDOR_ID, PRODUCT_ID)
+        discovery.subscribe(lambda event, device_dict: queue_2_gui.put(
+            f"Device:\nDP100 {device_dict.get('serial_number')} {event}\n"))
+        discovery.start()
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, serial_number=args.serial, path=path,
+                               discovery=discovery)
+    if args.record and replay is None:
+        recorder = session.device_factory = HIDRecorder(args.record, session.device_factory)
+    dp = DP100Functions(queue_2_main, queue_2_gui, queue_2_png, session)
+    dp.csv_fsync = args.fsync
+    dp.log_format = args.log_format
+    dp.sample_rate = args.rate
+    if args.segment_minutes:
+        dp.segment_seconds = args.segment_minutes*60
+    if args.segment_mb:
+        dp.segment_bytes = int(args.segment_mb*1024*1024)
+    dp.keep_segments = args.keep_segments
+    dp.plot_decimation = None if args.decimation == "none" else args.decimation
+    if args.metrics_port:
+        dp.metrics.serve_http(args.metrics_port)
+    if args.metrics_file:
+        dp.metrics.start_textfile(args.metrics_file)
+    profiler = None
+    wrap = lambda target: target
+    if args.profile or args.profile_out:
+        profiler = dp.profiler = session.profiler = StageProfiler()
+        if args.profile:
+            profiler.start_reporting(args.profile, flags_2_main["flag_exit"])
+        if args.profile_out:
+            wrap = profiler.profile_thread
 
-    # Create GUI, main loop, and PNG creation threads
-    gui_thread = threading.Thread(target=start_gui, args=(flags_2_main, queue_2_main, queue_2_gui, dp.png_filename))
-    main_thread = threading.Thread(target=main_loop, args=(dp, flags_2_main, queue_2_main, queue_2_gui, queue_2_png))
-    png_thread = threading.Thread(target=dp.png_creation_thread)
+    if replay is not None:
+        threading.Thread(target=replay_finished, args=(replay, args, flags_2_main, queue_2_gui),
+                         daemon=True).start()
+
+    if args.daemon:              # no GUI, clients use dp100_daemon.DP100Client
+        wrap(run_daemon)(dp, args.daemon, args.rate)
+        if discovery is not None:
+            discovery.stop()
+        if recorder is not None:
+            recorder.close()
+            print(f"{recorder.records} HID transfers recorded to {args.record}")
+        flags_2_main["flag_exit"].set()
+        report_profile(profiler, args)
+        return
+
+    # Create GUI, main loop, PNG creation and acquisition threads
+    gui_thread = threading.Thread(target=wrap(start_gui), args=(flags_2_main, queue_2_main, queue_2_gui, dp.png_filename,
+                                                                dp.samples, dp.plot_decimation, dp.profiler))
+    main_thread = threading.Thread(target=wrap(main_loop), args=(dp, flags_2_main, queue_2_main, queue_2_gui, queue_2_png))
+    png_thread = threading.Thread(target=wrap(dp.png_creation_thread))
+    acquisition_thread = threading.Thread(target=wrap(acquisition_loop),
+                                          args=(dp, flags_2_main, queue_2_gui, queue_2_png, args.rate,
+                                                0.2, args.png_interval))
 
     gui_thread.start()
     main_thread.start()
     png_thread.start()
+    acquisition_thread.start()
 
     try:
         gui_thread.join()  # Wait for GUI thread to finish
@@ -127,13 +253,43 @@ def main():
 
     # Set the exit flag to stop the main loop and PNG thread
     flags_2_main["flag_exit"].set()
+    queue_2_main.put("exit:")  # wake up the main loop
     dp.png_thread_exit_flag = True
+    queue_2_png.put("EXIT")    # wake up the PNG thread
 
     # Wait for the main loop and PNG threads to finish
     main_thread.join()
+    acquisition_thread.join()
     png_thread.join()
+    print(f"PNG thread: {dp.png_stats}")
+    dp.close()
+    if discovery is not None:
+        discovery.stop()
+    if recorder is not None:
+        recorder.close()
+        print(f"{recorder.records} HID transfers recorded to {args.record}")
+    report_profile(profiler, args)
 
     print("All threads terminated. Program exiting.")
 
+def replay_finished(replay, args, flags_2_main, queue_2_gui):
+    """Stop polling at the end of the recording (the daemon exits)."""
+    replay.finished.wait()
+    print(f"Replay finished, {replay.mismatches} requests not in the recording")
+    queue_2_gui.put("Device:\nReplay finished\n")
+    flags_2_main["flag_exit"].set()
+    if args.daemon:
+        os.kill(os.getpid(), signal.SIGINT)
+
+def report_profile(profiler, args):
+    """Last stage breakdown and the pstats file, if profiling."""
+    if profiler is None:
+        return
+    if args.profile:
+        print("Profile:\n" + profiler.report())
+    if args.profile_out:
+        profiler.dump_stats(args.profile_out)
+        print(f"cProfile data written to {args.profile_out}")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
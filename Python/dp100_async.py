@@ -0,0 +1,106 @@
+"""  DP100 asyncio client
+
+    Awaitable DP100 commands for asyncio test rigs. The blocking HID I/O
+    runs on one worker thread, so the event loop never waits on USB and
+    the device only ever sees one request at a time:
+
+        async with AsyncDP100() as dp:
+            await dp.change_profile(1, 5.0, 0.5)
+            await dp.activate_profile(1)
+            await dp.on_off()
+            async for timestamp, basic_info in dp.stream(rate=50):
+                ...
+"""
+
+import asyncio
+import queue
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from dp100_functions import DP100Functions, DiscardQueue
+
+class AsyncDP100:
+    def __init__(self, dp=None, session=None):
+        """ Wrap an existing DP100Functions or create one (without GUI,
+            working directory and log files left alone) on the given
+            DP100Session (default: the USB device). """
+        if dp is None:
+            dp = DP100Functions(queue.Queue(), DiscardQueue(), queue.Queue(), session,
+                                library=True)
+        self.dp = dp
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dp100")
+        self.lock = asyncio.Lock()  # commands are served in the order they come in
+
+    async def _call(self, function, *args):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, function, *args)
+
+    def _read_basic_info(self):
+        try:
+            return self.dp.read_basic_info()
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
+
+    async def get_device_info(self):
+        return await self._call(self.dp.get_device_info)
+
+    async def get_basic_info(self):
+        """ Basic info dict (no CSV line, no GUI message), None on error. """
+        return await self._call(self._read_basic_info)
+
+    async def get_active_profile_info(self):
+        return await self._call(self.dp.get_active_profile_info)
+
+    async def get_profiles(self):
+        return await self._call(self.dp.get_profiles)
+
+    async def change_profile(self, nr, vo_set, io_set):
+        return await self._call(self.dp.change_profile, nr, vo_set, io_set)
+
+    async def sync_profiles(self, desired, verify=True):
+        return await self._call(self.dp.sync_profiles, desired, verify)
+
+    async def activate_profile(self, nr):
+        return await self._call(self.dp.activate_profile, nr)
+
+    async def on_off(self):
+        return await self._call(self.dp.on_off)
+
+    async def off(self):
+        return await self._call(self.dp.off)
+
+    async def stream(self, rate=None, max_samples=None):
+        """ Async version of DP100Functions.stream_basic_info(): yields
+            (timestamp, basic_info) at rate samples per second (None or 0
+            for back-to-back). Commands awaited meanwhile get their turn
+            between two samples. """
+        period = 1/rate if rate else 0.0
+        next_time = monotonic()
+        samples = 0
+        while max_samples is None or samples < max_samples:
+            delay = next_time - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            timestamp = monotonic()
+            basic_info = await self.get_basic_info()
+            if basic_info is None:
+                next_time = timestamp + max(period, 1.0)  # device gone, back off
+                if not self.dp.session.connected.is_set():  # unplugged, wait for it instead
+                    while not self.dp.session.connected.is_set():
+                        await asyncio.sleep(0.1)
+                    next_time = monotonic()
+                continue
+            yield timestamp, basic_info
+            samples += 1
+            next_time = max(next_time + period, timestamp)
+
+    async def close(self):
+        await self._call(self.dp.close)
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
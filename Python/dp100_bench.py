@@ -0,0 +1,288 @@
+"""  DP100 benchmarks
+
+    Times the acquisition, logging and plotting stages against the
+    software emulator and prints the results as JSON, e.g.
+
+        python dp100_bench.py --output bench_1.json
+        python dp100_bench.py --png-rows 1000,100000 --samples 5000
+
+    Compare two result files to spot regressions between versions. """
+
+import os
+import io
+import sys
+import csv
+import json
+import queue
+import timeit
+import platform
+import argparse
+import tempfile
+import contextlib
+from time import sleep, perf_counter
+from datetime import datetime, timedelta
+from dp100_functions import DP100Functions
+from dp100_session import DP100Session
+from dp100_emulator import DP100Emulator
+from dp100_protocol import VENDOR_ID, PRODUCT_ID, REQUEST_BASIC_INFO
+from dp100_ringbuffer import SampleRingBuffer
+from dp100_capture import CaptureWriter, CaptureReader
+from dp100_multi import DP100Bank
+from dp100_replay import HIDReplay
+import dp100_codec as codec
+
+def time_per_call(function, min_time=0.5):
+    """ Mean seconds per call, repeated until min_time is reached. """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    runs = max(1, int(min_time/max(timer.timeit(number), 1e-9)))
+    return timer.timeit(number*runs)/(number*runs)
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+    values = sorted(values)
+    result = {}
+    for point in points:
+        index = min(len(values) - 1, int(round(point/100*(len(values) - 1))))
+        result["p" + str(point)] = values[index]
+    return result
+
+def make_dp(workdir, latency=0.0):
+    """ DP100Functions talking to an emulator with the output switched on,
+        writing its files to workdir. """
+    emulator = DP100Emulator(latency=latency, load_ohm=10.0, noise=0.01)
+    session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=emulator)
+    dp = DP100Functions(queue.Queue(), queue.Queue(), queue.Queue(), session, library=True)
+    dp.csv_filename = os.path.join(workdir, "dp100_vi_data.csv")
+    dp.capture_filename = os.path.join(workdir, "dp100_vi_data.dp100")
+    dp.png_filename = os.path.join(workdir, "dp100_vi_data.png")
+    with contextlib.redirect_stdout(io.StringIO()):
+        dp.on_off()
+    return dp
+
+def drain(q):
+    while not q.empty():
+        q.get_nowait()
+
+def bench_crc(workdir):
+    dp = make_dp(workdir)
+    frame = bytearray(REQUEST_BASIC_INFO)
+    return {"modbus_crc_14_bytes_s": time_per_call(lambda: dp.modbus_crc(frame[0:14]))}
+
+def bench_decode(workdir):
+    dp = make_dp(workdir)
+    response = dp.session.transfer(REQUEST_BASIC_INFO)
+    result = {"decode_basic_info_s": time_per_call(lambda: codec.BASIC_INFO.decode(response))}
+    def get_basic_info():
+        dp.get_basic_info()
+        drain(dp.queue_2_gui)
+    result["get_basic_info_s"] = time_per_call(get_basic_info)
+    return result
+
+def bench_csv(workdir):
+    dp = make_dp(workdir)
+    dp.create_csv_file()
+    basic_info = dp.get_basic_info()
+    result = {"csv_append_s": time_per_call(lambda: dp.append_csv(basic_info))}
+    dp.close()
+    return result
+
+def bench_capture(workdir, records=100000):
+    """ Binary capture: append cost, open and time-range slice of a
+        capture with the given number of records, CSV export of the slice. """
+    dp = make_dp(workdir)
+    dp.start_capture()
+    basic_info = dp.read_basic_info()
+    result = {"capture_append_s": time_per_call(
+        lambda: dp.capture_writer.append_basic_info(basic_info))}
+    dp.close()
+    filename = os.path.join(workdir, f"capture_{records}.dp100")
+    writer = CaptureWriter(filename, flush_rows=4096)
+    for i in range(records):
+        writer.append(1735689600 + i, 5.0, 0.5, 20.0, 25.0, 25.0)
+    writer.close()
+    middle = 1735689600 + records//2
+    def open_slice():
+        return len(CaptureReader(filename).slice(middle, middle + 60))
+    result[f"capture_open_slice_{records}_records_s"] = time_per_call(open_slice)
+    start = perf_counter()
+    CaptureReader(filename).export_csv(os.path.join(workdir, "export.csv"), middle, middle + 3600)
+    result["capture_export_3600_rows_s"] = perf_counter() - start
+    return result
+
+def write_csv(filename, rows):
+    start = datetime(2025, 1, 1)
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Timestamp", "Vout (V)", "Iout (A)"])
+        for i in range(rows):
+            time = (start + timedelta(seconds=i)).strftime("%Y-%m-%dT%H:%M:%S")
+            writer.writerow([time, 5.0 + (i % 100)/1000, 0.5 + (i % 37)/1000])
+
+def bench_png(workdir, row_counts):
+    dp = make_dp(workdir)
+    result = {}
+    for rows in row_counts:
+        csv_filename = os.path.join(workdir, f"png_{rows}.csv")
+        png_filename = os.path.join(workdir, f"png_{rows}.png")
+        write_csv(csv_filename, rows)
+        start = perf_counter()
+        dp.create_png_from_csv(csv_filename, png_filename)
+        result[f"create_png_{rows}_rows_s"] = perf_counter() - start
+        # persistent plot from the ring buffer: time for the frame after one new sample
+        dp.samples = SampleRingBuffer(max(rows + 1, 2))
+        basic_info = dp.read_basic_info()
+        for i in range(rows):
+            dp.samples.append_basic_info(i, basic_info, wall_time=1735689600 + i)
+        dp.render_png()
+        dp.samples.append_basic_info(rows, basic_info, wall_time=1735689600 + rows)
+        start = perf_counter()
+        dp.render_png()
+        result[f"render_png_next_frame_{rows}_rows_s"] = perf_counter() - start
+        drain(dp.queue_2_gui)
+    return result
+
+class NullWidget:
+    """ Accepts every Tk call the GUI makes and does nothing. """
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def winfo_exists(self):
+        return False
+
+def bench_gui(workdir):
+    from dp100_gui import GUI
+    dp = make_dp(workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dp.get_basic_info()
+        dp.get_active_profile_info(True)
+        dp.get_profiles()
+    messages = {}
+    while not dp.queue_2_gui.empty():
+        message = dp.queue_2_gui.get_nowait()
+        messages[message.split("\n")[0]] = message
+    gui = GUI({}, queue.Queue(), queue.Queue(), dp.png_filename)
+    gui.mainWin = gui.txt_win = gui.butt_on_off = gui.label_PNG = NullWidget()
+    gui.device_info = gui.basic_info = gui.voltage = gui.current = NullWidget()
+    gui.profiles = [NullWidget() for i in range(10)]
+    gui.butt_profiles = [NullWidget() for i in range(10)]
+    result = {}
+    for name, message in messages.items():
+        def handle():
+            gui.queue_2_gui.put(message)
+            gui.check_queue_from_main()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result["gui_" + name.strip(":").lower() + "_s"] = time_per_call(handle)
+    return result
+
+def bench_end_to_end(workdir, samples, latency):
+    """ Unthrottled sample stream with logging, like the acquisition path. """
+    dp = make_dp(workdir, latency)
+    dp.start_log()
+    durations = []
+    start = last = perf_counter()
+    for timestamp, basic_info in dp.stream_basic_info(max_samples=samples):
+        dp.record_sample(timestamp, basic_info)
+        now = perf_counter()
+        durations.append(now - last)
+        last = now
+    total = perf_counter() - start
+    dp.close()
+    result = {"samples": samples, "emulator_latency_s": latency,
+              "samples_per_s": samples/total}
+    for name, value in percentiles(durations).items():
+        result["latency_" + name + "_s"] = value
+    return result
+
+def bench_multi(workdir, unit_counts=(1, 2, 4), duration=1.0, latency=0.002):
+    """ Aggregate samples per second with several emulated units polled
+        in parallel, each with its own handle and thread. """
+    result = {}
+    for units in unit_counts:
+        bank = DP100Bank.emulated(units, latency, rate=0)
+        for name, dp in bank.units.items():
+            dp.capture_filename = os.path.join(workdir, f"multi_{name}.dp100")
+        with contextlib.redirect_stdout(io.StringIO()):
+            bank.start()
+            sleep(duration)
+            bank.stop()
+        result[f"samples_per_s_{units}_units"] = sum(bank.counts.values())/duration
+    result["emulator_latency_s"] = latency
+    return result
+
+def bench_replay(workdir, filename, speed=0.0):
+    """ End-to-end path driven by a recorded session (dp100.py --record)
+        instead of the emulator. """
+    replay = HIDReplay(filename, speed)
+    session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=replay)
+    dp = DP100Functions(queue.Queue(), queue.Queue(), queue.Queue(), session, library=True)
+    dp.capture_filename = os.path.join(workdir, "replay.dp100")
+    durations = []
+    start = last = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        dp.get_device_info()         # first recorded request
+        dp.start_log()
+        for timestamp, basic_info in dp.stream_basic_info(stop_event=replay.finished):
+            dp.record_sample(timestamp, basic_info)
+            now = perf_counter()
+            durations.append(now - last)
+            last = now
+    total = perf_counter() - start
+    dp.close()
+    result = {"transfers": replay.header["transfers"], "speed": speed,
+              "samples": len(durations), "mismatches": replay.mismatches,
+              "samples_per_s": len(durations)/total if total else 0.0}
+    if durations:
+        for name, value in percentiles(durations).items():
+            result["latency_" + name + "_s"] = value
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="DP100 manipulator benchmarks")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--png-rows", default="1000,100000,1000000",
+                        help="comma separated CSV sizes for the PNG benchmark")
+    parser.add_argument("--samples", type=int, default=2000,
+                        help="samples for the end-to-end benchmark")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="emulator response time in seconds")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="also run the end-to-end path on a recorded session (dp100.py --record)")
+    parser.add_argument("--replay-speed", type=float, default=0.0, metavar="X",
+                        help="replay speed, 0 for as fast as possible (default)")
+    parser.add_argument("--skip", default="",
+                        help="comma separated stages to skip (crc,decode,csv,capture,png,gui,end_to_end,multi,replay)")
+    args = parser.parse_args()
+    skip = set(args.skip.split(","))
+    row_counts = [int(rows) for rows in args.png_rows.split(",") if rows]
+    results = {"timestamp": datetime.now().isoformat(timespec="seconds"),
+               "python": sys.version.split()[0],
+               "platform": platform.platform(),
+               "stages": {}}
+    stages = results["stages"]
+    with tempfile.TemporaryDirectory() as workdir:
+        if "crc" not in skip:
+            stages["crc"] = bench_crc(workdir)
+        if "decode" not in skip:
+            stages["decode"] = bench_decode(workdir)
+        if "csv" not in skip:
+            stages["csv"] = bench_csv(workdir)
+        if "capture" not in skip:
+            stages["capture"] = bench_capture(workdir)
+        if "png" not in skip:
+            stages["png"] = bench_png(workdir, row_counts)
+        if "gui" not in skip:
+            stages["gui"] = bench_gui(workdir)
+        if "end_to_end" not in skip:
+            stages["end_to_end"] = bench_end_to_end(workdir, args.samples, args.latency)
+        if "multi" not in skip:
+            stages["multi"] = bench_multi(workdir)
+        if args.replay and "replay" not in skip:
+            stages["replay"] = bench_replay(workdir, args.replay, args.replay_speed)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+if __name__ == '__main__':
+    main()
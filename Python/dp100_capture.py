@@ -0,0 +1,464 @@
+"""  DP100 binary capture files
+
+    Fixed-size little endian records behind a 64-byte header:
+
+        header  magic "DP100CAP", version, header size, record size,
+                sample rate, device serial number, start time
+        record  time (float64, epoch seconds), vout, iout, vin, temp1,
+                temp2 (float32)
+
+    Every INDEX_INTERVAL records the writer adds (time, record number) to a
+    sidecar index file (<capture>.idx). CaptureReader maps the records with
+    numpy.memmap, so even a multi-day capture opens instantly and a time
+    range is found with two binary searches instead of a scan.
+
+    For long unattended runs SegmentedCaptureWriter splits the capture
+    into segments of bounded duration or size in one directory. Closed
+    segments are gzip compressed by a background thread and a manifest
+    (manifest.json) lists the time range of every segment, so a reader
+    only opens the segments it needs.
+
+        python dp100_capture.py info dp100_vi_data.dp100
+        python dp100_capture.py export dp100_vi_data.dp100 out.csv
+        python dp100_capture.py export dp100_capture out.csv --start 2025-06-01T12:00
+"""
+
+import os
+import csv
+import gzip
+import json
+import queue
+import shutil
+import struct
+import argparse
+import threading
+from time import time, monotonic
+from datetime import datetime
+import numpy as np
+from dp100_log import FlushTimer
+
+MAGIC = b"DP100CAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHHHHd16sd16x")   # 64 bytes
+RECORD = np.dtype([("time", "<f8"), ("vout", "<f4"), ("iout", "<f4"),
+                   ("vin", "<f4"), ("temp1", "<f4"), ("temp2", "<f4")])
+INDEX = np.dtype([("time", "<f8"), ("record", "<u8")])
+INDEX_INTERVAL = 1024
+
+class CaptureWriter:
+    def __init__(self, filename, serial_number="", sample_rate=0.0,
+                 flush_rows=256, flush_interval=1.0):
+        """ Create a new capture file (an existing one is replaced). """
+        self.filename = filename
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.buffer = np.zeros(flush_rows, dtype=RECORD)
+        self.pending = 0             # records in buffer
+        self.records = 0             # records in the file
+        self.last_flush = monotonic()
+        self.flush_timer = FlushTimer(self.flush, flush_interval)  # records waiting too long
+        self.lock = threading.Lock()
+        self.file = open(filename, "wb")
+        self.index_file = open(filename + ".idx", "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, HEADER.size, RECORD.itemsize, 0,
+                                    sample_rate, serial_number.encode()[:16], time()))
+        self.file.flush()
+
+    def append(self, wall_time, vout, iout, vin, temp1, temp2):
+        """ Add one record, dropped if the writer is already closed. """
+        with self.lock:
+            if self.file is None:
+                return
+            self.buffer[self.pending] = (wall_time, vout, iout, vin, temp1, temp2)
+            self.pending += 1
+            if self.pending == self.flush_rows or \
+               monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+            else:
+                self.flush_timer.arm()
+
+    def append_basic_info(self, basic_info, wall_time=None):
+        if wall_time is None:
+            wall_time = time()
+        self.append(wall_time, basic_info["vout"], basic_info["iout"],
+                    basic_info["vin"], basic_info["temp1"], basic_info["temp2"])
+
+    def _flush(self):
+        self.flush_timer.cancel()
+        if self.file is None:
+            return
+        records = self.buffer[:self.pending]
+        # index entry for every record number that is a multiple of INDEX_INTERVAL
+        first = -self.records % INDEX_INTERVAL
+        if first < self.pending:
+            index = np.zeros(len(range(first, self.pending, INDEX_INTERVAL)), dtype=INDEX)
+            index["time"] = records["time"][first::INDEX_INTERVAL]
+            index["record"] = np.arange(self.records + first, self.records + self.pending,
+                                        INDEX_INTERVAL)
+            self.index_file.write(index.tobytes())
+            self.index_file.flush()
+        self.file.write(records.tobytes())
+        self.file.flush()
+        self.records += self.pending
+        self.pending = 0
+        self.last_flush = monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.file is not None:
+                self.file.close()
+                self.index_file.close()
+                self.file = None
+
+class CaptureReader:
+    def __init__(self, filename):
+        """ Map a capture file, a compressed segment (.gz) is read into
+            memory instead. """
+        self.filename = filename
+        data = None
+        if filename.endswith(".gz"):
+            with gzip.open(filename, "rb") as file:
+                data = file.read()
+            header = data[:HEADER.size]
+            index_filename = filename[:-3] + ".idx"
+        else:
+            with open(filename, "rb") as file:
+                header = file.read(HEADER.size)
+            index_filename = filename + ".idx"
+        if len(header) < HEADER.size:
+            raise ValueError(f"{filename}: not a DP100 capture")
+        magic, self.version, header_size, record_size, _, self.sample_rate, serial, \
+            self.start_time = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD.itemsize:
+            raise ValueError(f"{filename}: not a DP100 capture (version 1)")
+        self.serial_number = serial.rstrip(b"\x00").decode()
+        size = len(data) if data is not None else os.path.getsize(filename)
+        count = (size - header_size)//record_size  # ignore a cut off record
+        if count <= 0:
+            self.records = np.zeros(0, dtype=RECORD)
+        elif data is not None:
+            self.records = np.frombuffer(data, dtype=RECORD, count=count, offset=header_size)
+        else:
+            self.records = np.memmap(filename, dtype=RECORD, mode="r",
+                                     offset=header_size, shape=(count,))
+        try:
+            self.index = np.fromfile(index_filename, dtype=INDEX)
+            self.index = self.index[self.index["record"] < count]
+        except (FileNotFoundError, ValueError):
+            self.index = np.zeros(0, dtype=INDEX)
+
+    def __len__(self):
+        return len(self.records)
+
+    def time_range(self):
+        """ (first, last) record time, None if empty. """
+        if len(self.records) == 0:
+            return None
+        return float(self.records["time"][0]), float(self.records["time"][-1])
+
+    def _find(self, wall_time):
+        """ Number of the first record at or after wall_time. The sparse
+            index narrows the search to one block of INDEX_INTERVAL records. """
+        low, high = 0, len(self.records)
+        if len(self.index):
+            block = np.searchsorted(self.index["time"], wall_time, side="left")
+            if block > 0:
+                low = int(self.index["record"][block - 1])
+            if block < len(self.index):
+                high = int(self.index["record"][block]) + 1
+        return low + int(np.searchsorted(self.records["time"][low:high], wall_time, side="left"))
+
+    def slice(self, start=None, end=None):
+        """ Records with start <= time < end (epoch seconds), a view into
+            the memory map. """
+        first = 0 if start is None else self._find(start)
+        last = len(self.records) if end is None else self._find(end)
+        return self.records[first:max(first, last)]
+
+    def export_csv(self, csv_filename, start=None, end=None):
+        """ Write the records (or a time range) in the CSV format of the
+            live log. Returns the number of rows. """
+        return write_csv(csv_filename, self.slice(start, end))
+
+class SegmentedCaptureWriter:
+    def __init__(self, directory, serial_number="", sample_rate=0.0,
+                 segment_seconds=3600.0, segment_bytes=64*1024*1024,
+                 compress=True, keep_segments=None):
+        """ Capture into segments of at most segment_seconds or
+            segment_bytes (None: no limit). Only the newest keep_segments
+            segments are kept (None: all). Segments already listed in the
+            manifest of the directory are kept, numbering continues. """
+        self.directory = directory
+        self.serial_number = serial_number
+        self.sample_rate = sample_rate
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        self.keep_segments = keep_segments
+        self.lock = threading.Lock()        # manifest
+        self.write_lock = threading.Lock()  # append against close
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = read_manifest(directory)
+        self.manifest.setdefault("next", len(self.manifest["segments"]) + 1)
+        for segment in self.manifest["segments"]:
+            if segment["end"] is None:      # left open by a crash
+                self._close_entry(segment)
+        self._write_manifest()
+        self.writer = None                  # CaptureWriter of the open segment
+        self.segment = None                 # its manifest entry
+        self.compress_queue = queue.Queue()
+        self.compress_thread = threading.Thread(target=self._compress_worker, daemon=True)
+        self.compress_thread.start()
+        for segment in self.manifest["segments"]:
+            if compress and not segment["file"].endswith(".gz"):
+                self.compress_queue.put(segment)
+
+    def append(self, wall_time, vout, iout, vin, temp1, temp2):
+        """ Add one record, dropped if the writer is already closed. """
+        with self.write_lock:
+            if self.closed:                 # no new segment after close()
+                return
+            if self.writer is None or self._full(wall_time):
+                self._roll(wall_time)
+            self.writer.append(wall_time, vout, iout, vin, temp1, temp2)
+            self.segment["records"] += 1
+            self.segment["last"] = wall_time
+
+    def append_basic_info(self, basic_info, wall_time=None):
+        if wall_time is None:
+            wall_time = time()
+        self.append(wall_time, basic_info["vout"], basic_info["iout"],
+                    basic_info["vin"], basic_info["temp1"], basic_info["temp2"])
+
+    def _full(self, wall_time):
+        if self.segment_seconds is not None and \
+           wall_time - self.segment["start"] >= self.segment_seconds:
+            return True
+        return self.segment_bytes is not None and \
+               (self.segment["records"] + 1)*RECORD.itemsize + HEADER.size > self.segment_bytes
+
+    def _roll(self, wall_time):
+        """ Close the open segment and start the next one at wall_time. """
+        self._close_segment()
+        with self.lock:
+            segments = self.manifest["segments"]
+            number = self.manifest["next"]
+            self.manifest["next"] = number + 1
+            self.segment = {"file": f"segment_{number:06d}.dp100", "start": wall_time,
+                            "end": None, "last": wall_time, "records": 0}
+            segments.append(self.segment)
+            self._write_manifest()
+        self.writer = CaptureWriter(os.path.join(self.directory, self.segment["file"]),
+                                    self.serial_number, self.sample_rate)
+
+    def _close_entry(self, segment):
+        """ Take end and records of a segment from its file. """
+        try:
+            reader = CaptureReader(os.path.join(self.directory, segment["file"]))
+            time_range = reader.time_range()
+            segment["records"] = len(reader)
+        except (OSError, ValueError):
+            time_range = None
+            segment["records"] = 0
+        segment["end"] = time_range[1] if time_range else segment["start"]
+
+    def _close_segment(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        with self.lock:
+            self.segment["end"] = self.segment.pop("last")
+            self._write_manifest()
+        if self.compress:
+            self.compress_queue.put(self.segment)
+        else:
+            self._drop_old()
+        self.writer = None
+        self.segment = None
+
+    def _compress_worker(self):
+        while True:
+            segment = self.compress_queue.get()
+            if segment is None:
+                break
+            filename = os.path.join(self.directory, segment["file"])
+            try:
+                with open(filename, "rb") as source, \
+                     gzip.open(filename + ".gz.tmp", "wb", compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, 1024*1024)
+                os.replace(filename + ".gz.tmp", filename + ".gz")
+                with self.lock:
+                    segment["file"] += ".gz"
+                    self._write_manifest()
+                os.remove(filename)
+            except OSError as e:
+                print(f"Error compressing {filename}: {e}")
+            self._drop_old()
+
+    def _drop_old(self):
+        """ Delete the oldest closed segments beyond keep_segments. """
+        if self.keep_segments is None:
+            return
+        with self.lock:
+            segments = self.manifest["segments"]
+            closed = [segment for segment in segments if segment is not self.segment]
+            old = closed[:max(0, len(closed) - self.keep_segments)]
+            if not old:
+                return
+            self.manifest["segments"] = [segment for segment in segments if segment not in old]
+            self._write_manifest()
+        for segment in old:
+            base = os.path.join(self.directory, segment["file"].removesuffix(".gz"))
+            for filename in (base, base + ".gz", base + ".idx"):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+    def _write_manifest(self):
+        """ Replace the manifest atomically, the caller holds the lock. """
+        manifest = {"version": VERSION, "serial_number": self.serial_number,
+                    "sample_rate": self.sample_rate, "next": self.manifest["next"],
+                    "segments": [{key: value for key, value in segment.items() if key != "last"}
+                                 for segment in self.manifest["segments"]]}
+        filename = os.path.join(self.directory, "manifest.json")
+        with open(filename + ".tmp", "w") as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(filename + ".tmp", filename)
+
+    def flush(self):
+        with self.write_lock:
+            if self.writer is not None:
+                self.writer.flush()
+
+    def close(self):
+        """ Close the open segment and wait for the compression. """
+        with self.write_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._close_segment()
+        self.compress_queue.put(None)
+        self.compress_thread.join()
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, "manifest.json")) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"version": VERSION, "next": 1, "segments": []}
+
+class SegmentedCaptureReader:
+    def __init__(self, directory):
+        """ Reader for a directory written by SegmentedCaptureWriter. """
+        self.directory = directory
+        manifest = read_manifest(directory)
+        self.serial_number = manifest.get("serial_number", "")
+        self.sample_rate = manifest.get("sample_rate", 0.0)
+        self.segments = manifest["segments"]
+
+    def __len__(self):
+        total = 0
+        for segment in self.segments:
+            if segment["end"] is None:          # open segment, count from the file
+                total += len(self._reader(segment))
+            else:
+                total += segment["records"]
+        return total
+
+    def _reader(self, segment):
+        filename = os.path.join(self.directory, segment["file"])
+        if not os.path.exists(filename) and os.path.exists(filename + ".gz"):
+            filename += ".gz"                   # compressed after the manifest was read
+        return CaptureReader(filename)
+
+    def time_range(self):
+        ranges = [self._reader(segment).time_range() if segment["end"] is None
+                  else (segment["start"], segment["end"])
+                  for segment in self.segments if segment["records"] or segment["end"] is None]
+        ranges = [time_range for time_range in ranges if time_range]
+        if not ranges:
+            return None
+        return ranges[0][0], ranges[-1][1]
+
+    def slice(self, start=None, end=None):
+        """ Records with start <= time < end, read from the segments that
+            overlap the range only. A copy, not a view. """
+        parts = []
+        for segment in self.segments:
+            if end is not None and segment["start"] >= end:
+                continue
+            if start is not None and segment["end"] is not None and segment["end"] < start:
+                continue
+            parts.append(np.array(self._reader(segment).slice(start, end)))
+        if not parts:
+            return np.zeros(0, dtype=RECORD)
+        return np.concatenate(parts)
+
+    def export_csv(self, csv_filename, start=None, end=None):
+        return write_csv(csv_filename, self.slice(start, end))
+
+def write_csv(csv_filename, records):
+    """ Write capture records in the CSV format of the live log.
+        Returns the number of rows. """
+    with open(csv_filename, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Timestamp", "Vout (V)", "Iout (A)"])
+        for chunk in range(0, len(records), 65536):
+            part = records[chunk:chunk + 65536]
+            writer.writerows(zip(
+                (datetime.fromtimestamp(t).isoformat(timespec="milliseconds")
+                 for t in part["time"].tolist()),
+                np.round(part["vout"], 3).tolist(),
+                np.round(part["iout"], 3).tolist()))
+    return len(records)
+
+def open_capture(path):
+    """ CaptureReader for a file, SegmentedCaptureReader for a directory. """
+    if os.path.isdir(path):
+        return SegmentedCaptureReader(path)
+    return CaptureReader(path)
+
+def parse_time(text):
+    """ ISO time (local) or epoch seconds. """
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+def main():
+    parser = argparse.ArgumentParser(description="DP100 capture files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="show header and time range")
+    info.add_argument("capture", help="capture file or segment directory")
+    export = sub.add_parser("export", help="export (a time range) to CSV")
+    export.add_argument("capture", help="capture file or segment directory")
+    export.add_argument("csv")
+    export.add_argument("--start", help="ISO time or epoch seconds")
+    export.add_argument("--end", help="ISO time or epoch seconds")
+    args = parser.parse_args()
+    reader = open_capture(args.capture)
+    if args.command == "info":
+        print(f"Serial number: {reader.serial_number}")
+        print(f"Sample rate: {reader.sample_rate} Hz")
+        print(f"Records: {len(reader)}")
+        if isinstance(reader, SegmentedCaptureReader):
+            print(f"Segments: {len(reader.segments)}")
+        time_range = reader.time_range()
+        if time_range:
+            print(f"From: {datetime.fromtimestamp(time_range[0])}")
+            print(f"To: {datetime.fromtimestamp(time_range[1])}")
+    else:
+        rows = reader.export_csv(args.csv, parse_time(args.start), parse_time(args.end))
+        print(f"{rows} rows written to {args.csv}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""  DP100 frame codec
+
+    Every response frame type is described once as a layout (field name,
+    struct format, scale). Decoding copies the response into a reused
+    buffer and unpacks all fields with one struct.unpack_from() call.
+    All values are little endian (LB first). """
+
+import struct
+import threading
+from dp100_protocol import (FRAME_SIZE, HEADER_RESPONSE, CMD_DEVICE_INFO,
+                            CMD_BASIC_INFO, CMD_PROFILE, crc16)
+
+PAYLOAD_OFFSET = 4
+
+def _cstring(raw):
+    return raw.split(b"\x00", 1)[0].decode("ascii", "replace")
+
+def _hex(raw):
+    return raw.hex()
+
+class FrameLayout:
+    def __init__(self, command, fields):
+        """ fields: list of (name, struct format, conversion). conversion is
+            None (raw value), a divisor (raw/divisor) or a function.
+            Fields named None are padding. """
+        self.command = command
+        self.struct = struct.Struct("<" + "".join(f[1] for f in fields))
+        self.length = self.struct.size
+        self.names = tuple(f[0] for f in fields if f[0] is not None)
+        self.conversions = tuple(f[2] for f in fields if f[0] is not None)
+        self.scales = tuple(c if isinstance(c, (int, float)) else None
+                            for c in self.conversions)
+        self.buffer = bytearray(FRAME_SIZE)      # reused for every decode
+        self.view = memoryview(self.buffer)
+        self.lock = threading.Lock()
+
+    def check(self, response):
+        """ True if response is a complete frame of this type. """
+        return (len(response) == FRAME_SIZE and response[0] == HEADER_RESPONSE
+                and response[1] == self.command and response[2] == 0x00
+                and response[3] == self.length)
+
+    def unpack(self, response):
+        """ Raw field values as tuple, None if the frame does not match. """
+        if not self.check(response):
+            return None
+        with self.lock:
+            self.buffer[:] = response
+            return self.struct.unpack_from(self.view, PAYLOAD_OFFSET)
+
+    def decode(self, response):
+        """ Field values converted to physical units as dict,
+            None if the frame does not match. """
+        raw = self.unpack(response)
+        if raw is None:
+            return None
+        values = {}
+        for name, conversion, value in zip(self.names, self.conversions, raw):
+            if conversion is None:
+                values[name] = value
+            elif callable(conversion):
+                values[name] = conversion(value)
+            else:
+                values[name] = value/conversion
+        return values
+
+    def encode_into(self, frame, values, header=0xfb):
+        """ Write a complete request frame with this layout into the
+            preallocated frame. values are in physical units, in field
+            order. Returns frame. """
+        raw = []
+        for scale, value in zip(self.scales, values):
+            raw.append(round(value*scale) if scale else value)
+        frame[0:4] = header, self.command, 0x00, self.length
+        self.struct.pack_into(frame, PAYLOAD_OFFSET, *raw)
+        end = PAYLOAD_OFFSET + self.length
+        crc = crc16(memoryview(frame)[0:end])
+        frame[end] = crc & 0xFF
+        frame[end+1] = crc >> 8
+        return frame
+
+# 0x10 device info (40 byte)
+DEVICE_INFO = FrameLayout(CMD_DEVICE_INFO, [
+    ("name", "16s", _cstring),
+    ("h_version", "H", 10),
+    ("s_version", "H", 10),
+    ("boot_ver", "H", 10),
+    ("run_area", "H", 10),
+    (None, "8x", None),
+    ("serial_number", "4s", _hex),
+    ("year", "H", None),
+    ("month", "B", None),
+    ("day", "B", None)])
+
+# 0x30 basic info (16 byte)
+BASIC_INFO = FrameLayout(CMD_BASIC_INFO, [
+    ("vin", "H", 1000),
+    ("vout", "H", 1000),
+    ("iout", "H", 1000),
+    ("vo_max", "H", 1000),
+    ("temp1", "H", 10),
+    ("temp2", "H", 10),
+    ("dc_5v", "H", 1000),
+    ("mode_out", "B", None),
+    ("work_st", "B", None)])
+
+# 0x35 profile (10 byte), same layout for read and write
+PROFILE = FrameLayout(CMD_PROFILE, [
+    ("index", "B", None),   # profile nr (+0x40 set, +0x20 switch, +0xA0 activate)
+    ("state", "B", None),   # output on/off
+    ("vo_set", "H", 1000),
+    ("io_set", "H", 1000),
+    ("ovp_set", "H", 1000), # vmax
+    ("ocp_set", "H", 1000)]) # imax
+
+def encode_profile(frame, index, state, vo_set, io_set, ovp_set, ocp_set):
+    """ Profile write request into the preallocated 64-byte frame. """
+    return PROFILE.encode_into(frame, (index, state, vo_set, io_set,
+                                       ovp_set, ocp_set))
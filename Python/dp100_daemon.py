@@ -0,0 +1,277 @@
+"""  DP100 daemon
+
+    Headless mode: one process owns the DP100 (and the log), many local
+    clients share it through a Unix-domain socket. The wire protocol is
+    one JSON object per line in both directions:
+
+        -> {"id": 1, "cmd": "change_profile", "nr": 1, "vo_set": 5.0, "io_set": 0.5}
+        <- {"id": 1, "ok": true, "result": 1}
+        -> {"id": 2, "cmd": "subscribe", "every": 10}
+        <- {"id": 2, "ok": true, "result": null}
+        <- {"sample": {"t": 1748771234.5, "vout": 5.0, "iout": 0.5, ...}}
+
+    Commands: device_info, basic_info (latest sample, no USB round trip),
+    active_profile, profiles, change_profile, sync_profiles (write only
+    the profiles that differ), activate_profile, on_off, off, subscribe
+    (every n-th sample), unsubscribe, stats, metrics (Prometheus text).
+
+    The device is polled by one acquisition thread; commands go through
+    AsyncDP100 and get their turn between two samples. A client that reads
+    too slowly loses its oldest samples, it never holds up the others.
+
+        python dp100.py --daemon /tmp/dp100.sock --rate 10
+        python dp100_daemon.py call on_off
+        python dp100_daemon.py call change_profile nr=1 vo_set=5 io_set=0.5
+        python dp100_daemon.py call sync_profiles 'profiles={"1": {"vo_set": 5, "io_set": 0.5}}'
+        python dp100_daemon.py watch --every 10
+"""
+
+import os
+import json
+import socket
+import signal
+import asyncio
+import argparse
+import threading
+from collections import deque
+from time import time
+from dp100_async import AsyncDP100
+
+DEFAULT_SOCKET = "/tmp/dp100.sock"
+
+class DP100Daemon:
+    def __init__(self, dp, socket_path=DEFAULT_SOCKET, rate=1.0, socket_mode=0o660,
+                 queue_size=1000):
+        """ dp: DP100Functions owning the device, rate: samples per second
+            (None or 0 for as fast as possible), queue_size: samples kept
+            for a slow subscriber. """
+        self.dp = dp
+        self.client = AsyncDP100(dp)
+        self.socket_path = socket_path
+        self.rate = rate
+        self.socket_mode = socket_mode
+        self.queue_size = queue_size
+        self.device_info = None
+        self.latest = None           # newest sample dict
+        self.subscribers = {}        # writer: subscription dict
+        self.stats = {"samples": 0, "clients": 0, "dropped": 0}
+        self.stop_event = threading.Event()
+        self.commands = {"device_info": self.cmd_device_info,
+                         "basic_info": self.cmd_basic_info,
+                         "active_profile": lambda request: self.client.get_active_profile_info(),
+                         "profiles": lambda request: self.client.get_profiles(),
+                         "change_profile": lambda request: self.client.change_profile(
+                             int(request["nr"]), float(request["vo_set"]), float(request["io_set"])),
+                         "activate_profile": lambda request: self.client.activate_profile(
+                             int(request["nr"])),
+                         "sync_profiles": lambda request: self.client.sync_profiles(
+                             request["profiles"], bool(request.get("verify", True))),
+                         "on_off": lambda request: self.client.on_off(),
+                         "off": lambda request: self.client.off(),
+                         "stats": self.cmd_stats,
+                         "metrics": self.cmd_metrics}
+
+    async def serve(self):
+        """ Serve until SIGINT/SIGTERM. """
+        self.loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signal_number, stop.set)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)       # left over from a crash
+        server = await asyncio.start_unix_server(self.handle_client, self.socket_path)
+        os.chmod(self.socket_path, self.socket_mode)
+        self.device_info = await self.client.get_device_info()  # also starts the log
+        acquisition = threading.Thread(target=self.acquisition_loop, name="dp100-acquisition")
+        acquisition.start()
+        print(f"DP100 daemon listening on {self.socket_path}")
+        await stop.wait()
+        server.close()
+        await server.wait_closed()
+        self.stop_event.set()
+        await self.loop.run_in_executor(None, acquisition.join)
+        await self.client.close()
+        os.remove(self.socket_path)
+        print("DP100 daemon stopped.")
+
+    def acquisition_loop(self):
+        for timestamp, basic_info in self.dp.stream_basic_info(self.rate, self.stop_event):
+            self.dp.record_sample(timestamp, basic_info)
+            sample = {"t": time(), **basic_info}
+            self.loop.call_soon_threadsafe(self.publish, sample)
+
+    def publish(self, sample):
+        """ Hand a sample to every subscriber (event loop thread). """
+        self.latest = sample
+        self.stats["samples"] += 1
+        line = None
+        for subscription in self.subscribers.values():
+            subscription["count"] += 1
+            if subscription["count"] % subscription["every"]:
+                continue
+            if line is None:
+                line = (json.dumps({"sample": sample}) + "\n").encode()
+            queue = subscription["queue"]
+            if len(queue) == queue.maxlen:
+                self.stats["dropped"] += 1    # deque drops the oldest
+            queue.append(line)
+            subscription["ready"].set()
+
+    async def send_samples(self, writer, subscription):
+        """ Write the queued samples of one subscriber. """
+        queue = subscription["queue"]
+        while True:
+            await subscription["ready"].wait()
+            subscription["ready"].clear()
+            while queue:
+                writer.write(queue.popleft())
+            await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        self.stats["clients"] += 1
+        sender = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = {}
+                try:
+                    request = json.loads(line)
+                    response["id"] = request.get("id")
+                    command = request["cmd"]
+                    if command == "subscribe":
+                        if sender is None:
+                            subscription = {"every": max(1, int(request.get("every", 1))),
+                                            "count": 0, "ready": asyncio.Event(),
+                                            "queue": deque(maxlen=self.queue_size)}
+                            self.subscribers[writer] = subscription
+                            sender = asyncio.create_task(self.send_samples(writer, subscription))
+                        result = None
+                    elif command == "unsubscribe":
+                        self.subscribers.pop(writer, None)
+                        if sender is not None:
+                            sender.cancel()
+                            sender = None
+                        result = None
+                    elif command in self.commands:
+                        result = await self.commands[command](request)
+                    else:
+                        raise ValueError(f"unknown command {command}")
+                    response.update(ok=True, result=result)
+                except (ValueError, KeyError, TypeError) as e:
+                    response.update(ok=False, error=str(e))
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.subscribers.pop(writer, None)
+            if sender is not None:
+                sender.cancel()
+            self.stats["clients"] -= 1
+            writer.close()
+
+    async def cmd_device_info(self, request):
+        return self.device_info
+
+    async def cmd_basic_info(self, request):
+        if self.latest is not None:
+            return self.latest
+        return await self.client.get_basic_info()
+
+    async def cmd_stats(self, request):
+        return {**self.stats, "subscribers": len(self.subscribers)}
+
+    async def cmd_metrics(self, request):
+        """ Prometheus text of the DP100Functions metrics. """
+        return self.dp.metrics.render()
+
+def run_daemon(dp, socket_path=DEFAULT_SOCKET, rate=1.0):
+    asyncio.run(DP100Daemon(dp, socket_path, rate).serve())
+
+class DP100Client:
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        """ Blocking client for scripts. """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile("rwb")
+        self.next_id = 1
+        self.pending_samples = deque()  # arrived while waiting for a response
+
+    def call(self, cmd, **args):
+        """ Send a command and return its result, raises ValueError if the
+            daemon refuses it. """
+        request_id = self.next_id
+        self.next_id += 1
+        self.file.write((json.dumps({"id": request_id, "cmd": cmd, **args}) + "\n").encode())
+        self.file.flush()
+        while True:
+            message = self._read()
+            if "sample" in message:
+                self.pending_samples.append(message["sample"])
+            elif message.get("id") == request_id:
+                if not message["ok"]:
+                    raise ValueError(message["error"])
+                return message["result"]
+
+    def _read(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("daemon closed the connection")
+        return json.loads(line)
+
+    def samples(self, every=1):
+        """ Subscribe and yield sample dicts. """
+        self.call("subscribe", every=every)
+        while True:
+            while self.pending_samples:
+                yield self.pending_samples.popleft()
+            message = self._read()
+            if "sample" in message:
+                yield message["sample"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def main():
+    parser = argparse.ArgumentParser(description="DP100 daemon client")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"default {DEFAULT_SOCKET}")
+    sub = parser.add_subparsers(dest="command", required=True)
+    call = sub.add_parser("call", help="send one command, e.g. call change_profile nr=1 vo_set=5 io_set=0.5")
+    call.add_argument("cmd")
+    call.add_argument("args", nargs="*", metavar="KEY=VALUE")
+    watch = sub.add_parser("watch", help="print the telemetry")
+    watch.add_argument("--every", type=int, default=1, help="every n-th sample only")
+    args = parser.parse_args()
+    with DP100Client(args.socket) as client:
+        if args.command == "call":
+            arguments = dict(arg.split("=", 1) for arg in args.args)
+            try:
+                result = client.call(args.cmd, **{key: parse_value(value)
+                                                  for key, value in arguments.items()})
+                print(json.dumps(result, indent=1))
+            except ValueError as e:
+                print(f"Error: {e}")
+        else:
+            try:
+                for sample in client.samples(args.every):
+                    print(json.dumps(sample))
+            except KeyboardInterrupt:
+                pass
+
+if __name__ == '__main__':
+    main()
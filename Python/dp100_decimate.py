@@ -0,0 +1,72 @@
+"""  DP100 plot decimation
+
+    Reduce a series to about the pixel width of the plot before drawing,
+    so the render time depends on the output resolution, not on the
+    number of samples.
+
+        minmax  keeps the minimum and maximum of every bucket, peaks and
+                dips survive exactly (2 points per bucket)
+        lttb    Largest-Triangle-Three-Buckets, one point per bucket, a
+                smoother look that still follows the shape, but a
+                Python loop over the buckets (slower)
+
+    minmax is the default of PlotRenderer, the GUI and dp100.py.
+
+    x must be sorted. Both return (x, y) arrays. """
+
+import numpy as np
+
+def minmax(x, y, buckets):
+    """ Min and max of y in each of buckets equal slices, in time order. """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if buckets < 1 or n <= 2*buckets:
+        return x, y
+    size = -(-n//buckets)                       # ceil(n/buckets)
+    buckets = -(-n//size)
+    padded = np.empty(buckets*size, dtype=y.dtype)
+    padded[:n] = y
+    padded[n:] = y[-1]                          # repeats a real value, no new extreme
+    blocks = padded.reshape(buckets, size)
+    offsets = np.arange(buckets)*size
+    low = blocks.argmin(axis=1) + offsets
+    high = blocks.argmax(axis=1) + offsets
+    index = np.minimum(np.sort(np.stack((low, high), axis=1), axis=1).ravel(), n - 1)
+    return x[index], y[index]
+
+def lttb(x, y, points):
+    """ Largest-Triangle-Three-Buckets down to points points (first and
+        last point kept). Each bucket's pick depends on the one before,
+        so this keeps a Python loop over the buckets (the bucket means
+        are computed in one go): the slow path, minmax is the default. """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if points < 3 or n <= points:
+        return x, y
+    edges = np.linspace(1, n - 1, points - 1).astype(int)   # buckets between first and last
+    sizes = np.diff(edges)
+    # mean of the bucket after each bucket, the last point after the last one
+    mean_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1])[1:]/sizes[1:], x[-1])
+    mean_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1])[1:]/sizes[1:], y[-1])
+    index = np.empty(points, dtype=int)
+    index[0], index[-1] = 0, n - 1
+    selected = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # twice the triangle area (selected point, candidate, next mean)
+        area = np.abs((x[selected] - mean_x[bucket])*(y[start:end] - y[selected]) -
+                      (x[selected] - x[start:end])*(mean_y[bucket] - y[selected]))
+        selected = start + int(area.argmax())
+        index[bucket + 1] = selected
+    return x[index], y[index]
+
+def decimate(x, y, points, method="minmax"):
+    """ About points points of (x, y) with the given method, None for no
+        decimation. """
+    if method == "minmax":
+        return minmax(x, y, points//2)
+    if method == "lttb":
+        return lttb(x, y, points)
+    return np.asarray(x), np.asarray(y)
@@ -0,0 +1,98 @@
+"""  DP100 device discovery
+
+    Keeps the list of connected DP100s (path, serial number, product
+    strings from hid.enumerate()) in a cache and refreshes it from a
+    background thread every interval seconds. Subscribers are told about
+    units that were plugged in or removed, so a DP100Session with a
+    discovery opens devices by cached path (no enumeration on the polling
+    path) and fails at once instead of after a timeout while its unit is
+    gone:
+
+        discovery = DeviceDiscovery()
+        discovery.subscribe(lambda event, device_dict: print(event, device_dict["path"]))
+        discovery.start()
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, discovery=discovery)
+"""
+
+import threading
+from dp100_session import enumerate_devices
+from dp100_protocol import VENDOR_ID, PRODUCT_ID
+
+class DeviceDiscovery:
+    def __init__(self, vendor_id=VENDOR_ID, product_id=PRODUCT_ID, interval=1.0,
+                 enumerate_function=None):
+        """ enumerate_function() returns the hid.enumerate() dicts of the
+            connected units, default enumerate_devices(vendor_id, product_id). """
+        if enumerate_function is None:
+            enumerate_function = lambda: enumerate_devices(vendor_id, product_id)
+        self.enumerate_function = enumerate_function
+        self.interval = interval
+        self.devices = {}            # path: device dict
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.refresh()
+
+    def subscribe(self, callback):
+        """ callback(event, device_dict), event "added" or "removed",
+            called from the discovery thread. """
+        self.callbacks.append(callback)
+
+    def refresh(self):
+        """ Enumerate once, update the cache and notify the subscribers.
+            Returns the lists of added and removed device dicts. """
+        devices = {device_dict["path"]: device_dict for device_dict in self.enumerate_function()}
+        with self.lock:
+            added = [devices[path] for path in devices if path not in self.devices]
+            removed = [self.devices[path] for path in self.devices if path not in devices]
+            self.devices = devices
+        for device_dict in removed:
+            self._notify("removed", device_dict)
+        for device_dict in added:
+            self._notify("added", device_dict)
+        return added, removed
+
+    def _notify(self, event, device_dict):
+        for callback in self.callbacks:
+            try:
+                callback(event, device_dict)
+            except Exception as e:
+                print(f"Error in discovery callback: {e}")
+
+    def find(self, serial_number=None, path=None):
+        """ Cached device dict of the unit with this serial number (or
+            path, or the first unit), None if it is not connected. """
+        with self.lock:
+            devices = list(self.devices.values())
+        for device_dict in devices:
+            if matches(device_dict, serial_number, path):
+                return device_dict
+        return None
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="dp100-discovery", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error in device discovery: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+def matches(device_dict, serial_number=None, path=None):
+    """ True if the device dict is the unit asked for (None: any). """
+    if serial_number is not None:
+        return device_dict.get("serial_number") == serial_number
+    if path is not None:
+        return device_dict["path"] == path
+    return True
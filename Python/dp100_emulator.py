@@ -0,0 +1,170 @@
+"""  DP100 emulator
+
+    Software stand-in for an Alientek DP100 behind hid.device(). It speaks
+    the 0xFB/0xFA protocol, keeps 10 profiles and the output state and
+    drives a resistive load, so everything can run without hardware:
+
+        emulator = DP100Emulator(latency=0.002, load_ohm=10)
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=emulator)
+"""
+
+import random
+import threading
+from collections import deque
+from time import monotonic, sleep
+import dp100_codec as codec
+from dp100_protocol import (FRAME_SIZE, HEADER_REQUEST, HEADER_RESPONSE,
+                            CMD_DEVICE_INFO, CMD_BASIC_INFO, CMD_PROFILE,
+                            ACTIVE_PROFILE, VENDOR_ID, PRODUCT_ID, crc16)
+
+class DP100Emulator:
+    def __init__(self, latency=0.0, load_ohm=10.0, vin=20.0, noise=0.0,
+                 serial_number="00000001", path=b"dp100-emulator"):
+        """ latency: seconds between request and response,
+            load_ohm: resistive load on the output (None = open circuit),
+            noise: standard deviation of the measured values in V/A. """
+        self.latency = latency
+        self.load_ohm = load_ohm
+        self.vin = vin
+        self.noise = noise
+        self.serial_number = serial_number
+        self.path = path
+        # profiles: [vo_set, io_set, ovp_set, ocp_set]
+        self.profiles = [[v, 1.0, 30.5, 5.05] for v in
+                         (3.3, 5.0, 9.0, 12.0, 1.8, 2.5, 3.0, 4.5, 6.0, 10.0)]
+        self.active = 0
+        self.output = 0
+        self.is_open = False
+        self.pending = deque()  # (ready time, response)
+        self.frame = bytearray(FRAME_SIZE)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        """ Use the emulator itself as device_factory for DP100Session. """
+        return self
+
+    # hid.device interface ---------------------------------------------------
+
+    def open(self, vendor_id=VENDOR_ID, product_id=PRODUCT_ID, serial_number=None):
+        if (vendor_id, product_id) != (VENDOR_ID, PRODUCT_ID) or \
+           serial_number not in (None, self.serial_number):
+            raise OSError("open failed")
+        self.is_open = True
+
+    def open_path(self, path):
+        if path != self.path:
+            raise OSError("open failed")
+        self.is_open = True
+
+    def close(self):
+        with self.lock:
+            self.is_open = False
+            self.pending.clear()
+
+    def write(self, data):
+        if not self.is_open:
+            raise ValueError("not open")
+        with self.lock:
+            response = self.handle_request(bytes(data))
+            if response is not None:
+                self.pending.append((monotonic() + self.latency, response))
+        return len(data)
+
+    def read(self, max_length, timeout_ms=0):
+        if not self.is_open:
+            raise ValueError("not open")
+        with self.lock:
+            item = self.pending.popleft() if self.pending else None
+        if item is None:                      # nothing to answer, time out
+            if timeout_ms > 0:
+                sleep(timeout_ms/1000)
+            return []
+        ready, response = item
+        wait = ready - monotonic()
+        if timeout_ms >= 0 and wait > timeout_ms/1000:
+            sleep(timeout_ms/1000)
+            with self.lock:
+                self.pending.appendleft(item)
+            return []
+        if wait > 0:
+            sleep(wait)
+        return list(response[:max_length])
+
+    def get_manufacturer_string(self):
+        return "ALIENTEK"
+
+    def get_product_string(self):
+        return "ATK-MDP100"
+
+    def get_serial_number_string(self):
+        return self.serial_number
+
+    # device model -----------------------------------------------------------
+
+    def set_load(self, load_ohm):
+        """ Change the simulated load (None = open circuit). """
+        self.load_ohm = load_ohm
+
+    def measure(self):
+        """ Output voltage, current and CC flag for the active profile. """
+        vo_set, io_set = self.profiles[self.active][0:2]
+        if not self.output:
+            return 0.0, 0.0, 0
+        if self.load_ohm is None:
+            return vo_set, 0.0, 0
+        iout = vo_set/self.load_ohm
+        if iout > io_set:                     # constant current
+            return io_set*self.load_ohm, io_set, 1
+        return vo_set, iout, 0
+
+    def handle_request(self, request):
+        """ Answer one request frame, None for frames the DP100 ignores. """
+        if len(request) < 6 or request[0] != HEADER_REQUEST:
+            return None
+        command, length = request[1], request[3]
+        end = 4 + length
+        if end + 2 > len(request) or \
+           crc16(request[0:end]) != request[end] | request[end+1] << 8:
+            return None
+        if command == CMD_DEVICE_INFO:
+            return self.encode(codec.DEVICE_INFO, (b"DP100", 1.0, 1.1, 1.0, 1.0,
+                               bytes.fromhex(self.serial_number), 2025, 5, 1))
+        if command == CMD_BASIC_INFO:
+            vout, iout, cc = self.measure()
+            if self.noise:
+                vout = max(0.0, vout + random.gauss(0, self.noise))
+                iout = max(0.0, iout + random.gauss(0, self.noise))
+            temp = 25.0 + vout*iout
+            return self.encode(codec.BASIC_INFO, (self.vin, vout, iout, self.vin - 0.5,
+                                                  temp, temp + 0.5, 5.0, cc, self.output))
+        if command == CMD_PROFILE and length == 1:
+            nr = self.active if request[4] == ACTIVE_PROFILE else request[4]
+            if nr > 9:
+                return None
+            state = self.output if nr == self.active else 0
+            return self.encode(codec.PROFILE, (nr, state, *self.profiles[nr]))
+        if command == CMD_PROFILE and length == codec.PROFILE.length:
+            return self.write_profile(request)
+        return None
+
+    def write_profile(self, request):
+        # decode() only accepts response frames, so swap the header byte
+        index, state, *settings = codec.PROFILE.decode(
+            bytes([HEADER_RESPONSE]) + request[1:]).values()
+        action, nr = index & 0xF0, index & 0x0F
+        ok = nr <= 9 and action in (0x20, 0x40, 0xA0)
+        if ok:
+            self.profiles[nr] = settings
+            if action == 0x20:                # switch output
+                self.active = nr
+                self.output = 1 if state else 0
+            elif action == 0xA0:              # activate profile
+                self.active = nr
+        frame = bytearray(FRAME_SIZE)
+        frame[0:5] = HEADER_RESPONSE, CMD_PROFILE, 0x00, 0x01, 1 if ok else 0
+        frame[5:7] = crc16(frame[0:5]).to_bytes(2, "little")
+        return bytes(frame)
+
+    def encode(self, layout, values):
+        layout.encode_into(self.frame, values, header=HEADER_RESPONSE)
+        return bytes(self.frame)
@@ -1,66 +1,111 @@
 """  DP100 functions """
 
 import os
-from time import sleep
-import hid
-import csv
+import queue
+import threading
+from time import sleep, time, monotonic, perf_counter
 from datetime import datetime
-import matplotlib.pyplot as plt
-plt.matplotlib.use('agg')
+from dp100_session import DP100Session
+import dp100_protocol as protocol
+import dp100_codec as codec
+from dp100_plot import PlotRenderer
+from dp100_ringbuffer import SampleRingBuffer
+from dp100_log import CsvLogWriter
+from dp100_capture import CaptureWriter, SegmentedCaptureWriter
+from dp100_metrics import Metrics
+from dp100_profile import NULL_PROFILER
+from dp100_state import DeviceState, SETTINGS as PROFILE_SETTINGS
+
+class DiscardQueue:
+    """ Stands in for the GUI queue when nobody reads the messages. """
+    def put(self, item, block=True, timeout=None):
+        pass
 
 class DP100Functions:
-    def __init__(self, queue_2_main, queue_2_gui, queue_2_png):
-        """ Initialize the DP100Functions class with queues for communication. """
+    def __init__(self, queue_2_main, queue_2_gui, queue_2_png, session=None,
+                 sample_capacity=100000, library=False):
+        """ Initialize the DP100Functions class with queues for communication.
+            library: used inside another program, keep its working
+            directory and only log after an explicit start_log(). """
         self.queue_2_main = queue_2_main
         self.queue_2_gui = queue_2_gui
         self.queue_2_png = queue_2_png  # Correctly assign queue_2_png
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
-        os.chdir(self.script_dir)  # Set working directory to script's directory
-        self.vendor_id = 0x2e3c
-        self.product_id = 0xaf01
+        if not library:
+            os.chdir(self.script_dir)  # Set working directory to script's directory
+        self.auto_log = not library  # get_device_info() starts a new log
+        self.vendor_id = protocol.VENDOR_ID
+        self.product_id = protocol.PRODUCT_ID
+        # one open HID handle for all commands, reconnects on its own
+        if session is None:
+            session = DP100Session(self.vendor_id, self.product_id)
+        self.session = session
+        self.profile_frame = bytearray(64)  # reused for profile writes
         self.csv_filename = "dp100_vi_data.csv"
+        self.csv_writer = None       # CsvLogWriter, see csv_log()
+        self.csv_fsync = False
+        self.log_format = "bin"      # "bin": binary capture, "csv": CSV log
+        self.capture_filename = "dp100_vi_data.dp100"
+        self.capture_writer = None   # CaptureWriter, see start_log()
+        self.log_lock = threading.Lock()  # log writer swap against record_sample()
+        self.capture_directory = "dp100_capture"  # for segmented captures
+        self.segment_seconds = None  # segment limits, both None: one file
+        self.segment_bytes = None
+        self.keep_segments = None    # newest segments to keep, None: all
+        self.serial_number = ""      # for the capture header
+        self.sample_rate = 0.0
         self.png_filename = "dp100_vi_data.png"
-        self.png_width = 15,
-        self.png_height = 5,
+        self.png_width = 15
+        self.png_height = 5
+        self.plot_decimation = "minmax"  # "minmax", "lttb" or None
         self.max_voltage_axis = 10.0
         self.max_current_axis = 1.0
         self.png_thread_exit_flag = False  # Exit flag for the PNG thread
+        self.plot = None             # PlotRenderer, created by the PNG thread
+        self.samples = SampleRingBuffer(sample_capacity)  # recent samples for plot and GUI
+        self.png_stats = {"renders": 0, "skipped": 0, "last_render_s": 0.0,
+                          "max_render_s": 0.0, "total_render_s": 0.0}
+        self.metrics = Metrics()     # command latencies, errors, sample rate
+        self.profiler = NULL_PROFILER  # StageProfiler with dp100.py --profile
+        self.state = DeviceState()   # cached profiles, saves the read before a write
+        self.metrics.gauge("dp100_state_cache_total", lambda: self.state.hits, result="hit")
+        self.metrics.gauge("dp100_state_cache_total", lambda: self.state.misses, result="miss")
+        for name, q in (("main", queue_2_main), ("gui", queue_2_gui), ("png", queue_2_png)):
+            if hasattr(q, "qsize"):
+                self.metrics.gauge("dp100_queue_depth", q.qsize, queue=name)
+
+    def transfer(self, command, request, layout=None):
+        """ session.transfer() with metrics: duration per command,
+            timeouts (no answer), invalid responses and I/O errors.
+            Returns the response, decoded with layout if given (None if
+            invalid). """
+        start = perf_counter()
+        try:
+            response = self.session.transfer(request) # Send the data, read the resp.
+        except Exception:
+            self.state.invalidate()
+            self.metrics.command(command, perf_counter() - start, "io")
+            raise
+        with self.profiler.stage("decode"):
+            result = response if layout is None else layout.decode(response)
+        error = None
+        if not response:
+            error = "timeout"
+        elif result is None:
+            error = "invalid"
+        if error is not None:
+            self.state.invalidate()  # the device may have done it anyway
+            self.session.close()     # and drop anything still queued for us
+        self.metrics.command(command, perf_counter() - start, error)
+        return result
 
     def get_device_info(self):
         """ Sends a command field (64-byte) to the DP100 HID device
             and receives a 64-byte response with device infos. """
-        data_get_device_info = bytearray(64)
-        data_get_device_info[0:6] = 0xfb, 0x10, 0x00, 0x00, 0x30, 0xc5
-        device_info = {"name": None, "h_version": None, "s_version": None,
-                      "boot_ver": None, "run_area": None, "serial_number": None,
-                      "year": None, "month": None, "day": None}
         try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            device.write(data_get_device_info)          # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x10 \
-                and response[2] == 0x00 and response[3] == 0x28:
-                name=""
-                for i in range(4,20):
-                    if response[i] == 0x00:
-                        break
-                    else:
-                        name += chr(response[i])
-                device_info["name"] = name
-                device_info["h_version"] = (response[21]*255+response[20])/10
-                device_info["s_version"] = (response[23]*255+response[22])/10
-                device_info["boot_ver"] = (response[25]*255+response[24])/10
-                device_info["run_area"] = (response[27]*255+response[26])/10
-                serial_number=""
-                for i in range(36, 40):
-                    if response[i] < 16:
-                        serial_number+="0"
-                    serial_number+=str(hex(response[i]))[2:]
-                device_info["serial_number"] = serial_number
-                device_info["year"] = response[41]*255+response[40]
-                device_info["month"] = response[42]
-                device_info["day"] = response[43]
+            device_info = self.transfer("device_info", protocol.REQUEST_DEVICE_INFO,
+                                        codec.DEVICE_INFO)
+            if device_info is not None:
                 #prepare info for GUI
                 text = "Device_info:\n"
                 text += "Name: " + str(device_info["name"]) + "\n"
@@ -73,8 +118,10 @@ class DP100Functions:
                 text += "Month: " + str(device_info["month"]) + "\n"
                 text += "Day: " + str(device_info["day"]) + "\n"
                 self.queue_2_gui.put(text)
-                # create CSV file
-                self.create_csv_file()
+                # start a new log
+                self.serial_number = str(device_info["serial_number"])
+                if self.auto_log:
+                    self.start_log()
                 return device_info
             else:
                 print("Invalid response received")
@@ -84,49 +131,15 @@ class DP100Functions:
             text = "Error:\n" + str(e) + "\n"
             self.queue_2_gui.put(text)
             return None
-        finally:
-            device.close()
 
     def get_basic_info(self):
         """ Sends a command field (64-byte) to the DP100 HID device
             and receives a 64-byte response with basic infos. """
-        data_get_basic_info = bytearray(64)
-        data_get_basic_info[0:6] = 0xfb, 0x30, 0x00, 0x00, 0x31, 0x0f
-        basic_info = {"vin": None, "vout": None, "iout": None,
-                      "vo_max": None, "temp1": None, "temp2": None,
-                      "dc_5v": None, "mode_out": None, "work_st": None}
         try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            device.write(data_get_basic_info)           # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x30 \
-                and response[2] == 0x00 and response[3] == 0x10:
-                basic_info["vin"] = (response[5]*255+response[4])/1000
-                basic_info["vout"] = (response[7]*255+response[6])/1000
-                basic_info["iout"] = (response[9]*255+response[8])/1000
-                basic_info["vo_max"] = (response[11]*255+response[10])/1000
-                basic_info["temp1"] = (response[13]*255+response[12])/10
-                basic_info["temp2"] = (response[15]*255+response[14])/10
-                basic_info["dc_5v"] = (response[17]*255+response[16])/1000
-                basic_info["mode_out"] = response[18]
-                basic_info["work_st"] = response[19]
-                text = "Basic_info:\n"  # Prepare info for GUI
-                text += "Vin: " + str(basic_info["vin"]) + " V\n"
-                text += "Vout: " + str(basic_info["vout"]) + " V\n"
-                text += "Iout: " + str(basic_info["iout"]) + " A\n"
-                text += "Vo_max: " + str(basic_info["vo_max"]) + " V\n"
-                text += "Temp1: " + str(basic_info["temp1"]) + " °C\n"
-                text += "Temp2: " + str(basic_info["temp2"]) + " °C\n"
-                text += "DC 5V: " + str(basic_info["dc_5v"]) + " V\n"
-                text += "Mode: " + str(basic_info["mode_out"]) + "\n"
-                text += "Work state: " + str(basic_info["work_st"]) + "\n"
-                self.queue_2_gui.put(text)
-                current_time = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                # Save vin, vout, and current time to a CSV file
-                with open(self.csv_filename, mode="a") as file:
-                    writer = csv.writer(file)
-                    writer.writerow([current_time, basic_info["vout"], basic_info["iout"]])
+            basic_info = self.read_basic_info()
+            if basic_info is not None:
+                self.queue_2_gui.put(self.basic_info_text(basic_info))
+                self.record_sample(monotonic(), basic_info)
                 return basic_info
             else:
                 print("Invalid response received")
@@ -134,29 +147,80 @@ class DP100Functions:
         except Exception as e:
             print(f"Error: {e}")
             return None
-        finally:
-            device.close()
 
-    def get_active_profile_info(self, flag_send_2_gui = False):
+    def read_basic_info(self):
+        """ Basic info without GUI message and CSV line,
+            None on an invalid response. """
+        return self.transfer("basic_info", protocol.REQUEST_BASIC_INFO, codec.BASIC_INFO)
+
+    def basic_info_text(self, basic_info):
+        """ Prepare basic info for GUI. """
+        text = "Basic_info:\n"
+        text += "Vin: " + str(basic_info["vin"]) + " V\n"
+        text += "Vout: " + str(basic_info["vout"]) + " V\n"
+        text += "Iout: " + str(basic_info["iout"]) + " A\n"
+        text += "Vo_max: " + str(basic_info["vo_max"]) + " V\n"
+        text += "Temp1: " + str(basic_info["temp1"]) + " °C\n"
+        text += "Temp2: " + str(basic_info["temp2"]) + " °C\n"
+        text += "DC 5V: " + str(basic_info["dc_5v"]) + " V\n"
+        text += "Mode: " + str(basic_info["mode_out"]) + "\n"
+        text += "Work state: " + str(basic_info["work_st"]) + "\n"
+        return text
+
+    def stream_basic_info(self, rate=None, stop_event=None, max_samples=None):
+        """ Generator polling basic info back-to-back and yielding
+            (timestamp, basic_info) tuples, timestamp from time.monotonic().
+            rate: target samples per second, None or 0 for as fast as the
+            USB link allows. Ends when stop_event is set or after
+            max_samples. Late samples do not pile up, the schedule
+            continues from now. """
+        period = 1/rate if rate else 0.0
+        next_time = monotonic()
+        samples = 0
+        while stop_event is None or not stop_event.is_set():
+            delay = next_time - monotonic()
+            if delay > 0:
+                if stop_event is not None:
+                    if stop_event.wait(delay):
+                        break
+                else:
+                    sleep(delay)
+            timestamp = monotonic()
+            try:
+                basic_info = self.read_basic_info()
+                if basic_info is None:       # timeout or wrong frame, back off too
+                    next_time = timestamp + max(period, 1.0)
+            except Exception as e:
+                print(f"Error: {e}")
+                basic_info = None
+                next_time = timestamp + max(period, 1.0)  # device gone, back off
+                if not self.session.connected.is_set():  # unplugged, wait for it instead
+                    while not self.session.wait_connected(0.5):
+                        if stop_event is not None and stop_event.is_set():
+                            return
+                    next_time = monotonic()
+            if basic_info is not None:
+                yield timestamp, basic_info
+                samples += 1
+                if max_samples is not None and samples >= max_samples:
+                    break
+                next_time += period
+                if next_time < timestamp:
+                    next_time = timestamp
+
+    def get_active_profile_info(self, flag_send_2_gui = False, cached = False):
         """ Sends a command field (64-byte) to the DP100 HID device
-            and receives a 64-byte response with infos about the active profile. """
-        data_active_profile_info = bytearray(64)
-        data_active_profile_info[0:7] = 0xfb, 0x35, 0x00, 0x01, 0x80, 0xce, 0x28
-        parameter_info = {"index": None, "state": None, "vo_set": None,
-                          "io_set": None, "ovp_set": None, "ocp_set": None}
+            and receives a 64-byte response with infos about the active profile.
+            cached: answer from the state cache if it is fresh, only for
+            display, a write must not depend on it. """
         try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            device.write(data_active_profile_info)      # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
-                and response[2] == 0x00 and response[3] == 0x0a:
-                parameter_info["index"] = response[4]   # actual profile
-                parameter_info["state"] = response[5]   # on/off
-                parameter_info["vo_set"] = (response[7]*255+response[6])/1000
-                parameter_info["io_set"] = (response[9]*255+response[8])/1000
-                parameter_info["ovp_set"] = (response[11]*255+response[10])/1000 # vmax
-                parameter_info["ocp_set"] = (response[13]*255+response[12])/1000 # imax
+            parameter_info = self.state.active_profile() if cached else None
+            if parameter_info is None:
+                parameter_info = self.transfer("profile_read", protocol.REQUEST_ACTIVE_PROFILE,
+                                               codec.PROFILE)
+                if parameter_info is not None:
+                    self.state.update(parameter_info, active=True)
+            if parameter_info is not None:
                 self.max_voltage_axis = parameter_info["vo_set"] + parameter_info["vo_set"]/10
                 self.max_current_axis = parameter_info["io_set"] + parameter_info["io_set"]/10
                 if flag_send_2_gui:                #prepare info for GUI
@@ -173,309 +237,346 @@ class DP100Functions:
         except Exception as e:
             print(f"Error: {e}")
             return None
-        finally:
-            device.close()
 
-    def get_profiles(self):
-        """ Get info about the 10 profiles. """
-        data_get_profile = bytearray(64)
-        data_get_profile[0:4] = 0xfb, 0x35, 0x00, 0x01
+    def read_profiles(self, numbers=range(10)):
+        """ Profile dicts {nr: profile} of the given profiles, read in one
+            go. None on an invalid response. """
         profiles = {}
-        try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            for i in range(10):
-                data_get_profile[4] = i
-                crc = self.modbus_crc(data_get_profile[0:5])
-                data_get_profile[5] = crc[0]
-                data_get_profile[6] = crc[1]
-                #print(' '.join(format(x, '02x') for x in data_get_profile[0:10]))
-                device.write(data_get_profile)          # Send the data
-                response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-                if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
-                    and response[2] == 0x00 and response[3] == 0x0a:
-                    list = [response[4], response[5], (response[7]*255+response[6])/1000,
-                            (response[9]*255+response[8])/1000, (response[11]*255+response[10])/1000,
-                            (response[13]*255+response[12])/1000]
-                    profiles[i] = list
-                else:
+        with self.session.lock:
+            for nr in numbers:
+                profile = self.transfer("profile_read", protocol.REQUEST_PROFILE[nr],
+                                        codec.PROFILE)
+                if profile is None:
                     print("Invalid response received")
                     return None
-            #prepare info for GUI
-            text = "Profiles_info:\n"
-            for i in range(10):
-                text += "state_" + str(i) + ": " + str(profiles[i][1]) + "\n"
-                text += "vo_set_" + str(i) + ": " + str(round(profiles[i][2]+0.05,1)) + " V\n"
-                text += "io_set" + str(i) + ": " + str(round(profiles[i][3]+0.05,1)) + " A\n"
-            self.queue_2_gui.put(text)
+                profiles[nr] = profile
+        self.state.update_all(profiles)
+        return profiles
+
+    def profiles_text(self, profiles):
+        """ Prepare the 10 profiles for GUI. """
+        text = "Profiles_info:\n"
+        for i in range(10):
+            text += "state_" + str(i) + ": " + str(profiles[i][1]) + "\n"
+            text += "vo_set_" + str(i) + ": " + str(round(profiles[i][2]+0.05,1)) + " V\n"
+            text += "io_set" + str(i) + ": " + str(round(profiles[i][3]+0.05,1)) + " A\n"
+        return text
+
+    def get_profiles(self):
+        """ Get info about the 10 profiles. """
+        try:
+            profiles = self.read_profiles()
+            if profiles is None:
+                return None
+            profiles = {nr: list(profile.values()) for nr, profile in profiles.items()}
+            self.queue_2_gui.put(self.profiles_text(profiles))
             return profiles
         except Exception as e:
             print(f"Error: {e}")
             return None
-        finally:
-            device.close()
+
+    def write_profile(self, nr, command, state=None, vo_set=None, io_set=None, active=None):
+        """ Change profile nr and write it back with the command (0x40 set,
+            0x20 switch output, 0xA0 activate) added to nr. The profile
+            comes from the state cache, it is only read if the cache is
+            stale. 0x20 and 0xA0 change the active profile, the front panel
+            may have changed it too, so the active profile is read first
+            (active: that read if the caller has just made it). Returns the
+            answer byte of the device (1 = ok). """
+        with self.session.lock:  # keep read-modify-write together
+            if command in (0x20, 0xA0) and active is None:
+                active = self.transfer("profile_read", protocol.REQUEST_ACTIVE_PROFILE,
+                                       codec.PROFILE)
+                if active is None:
+                    print("Invalid response received")
+                    return None
+                self.state.update(active, active=True)
+            profile = self.state.profile(nr)
+            if profile is None:
+                profile = self.transfer("profile_read", protocol.REQUEST_PROFILE[nr],
+                                        codec.PROFILE)
+                if profile is None:
+                    print("Invalid response received")
+                    return None
+                self.state.update(profile)
+            if state is None:
+                state = profile["state"]
+            if vo_set is None:
+                vo_set = profile["vo_set"]
+            if io_set is None:
+                io_set = profile["io_set"]
+            codec.encode_profile(self.profile_frame, command + nr, state, vo_set,
+                                 io_set, profile["ovp_set"], profile["ocp_set"])
+            answer = protocol.write_ack(self.transfer("profile_write", self.profile_frame))
+            if answer == 1:
+                # as the device stores it, see codec.PROFILE
+                self.state.written({**profile, "state": state, "vo_set": round(vo_set*1000)/1000,
+                                    "io_set": round(io_set*1000)/1000}, command)
+            else:
+                self.state.invalidate()
+            return answer
 
     def change_profile(self, nr, vo_set, io_set):
         """ Change one profile. """
-        data_get_profile = bytearray(64)
-        data_get_profile[0:4] = 0xfb, 0x35, 0x00, 0x01
-        try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            data_get_profile[4] = nr
-            crc = self.modbus_crc(data_get_profile[0:5])
-            data_get_profile[5] = crc[0]
-            data_get_profile[6] = crc[1]
-            device.write(data_get_profile)          # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            #print(' '.join(format(x, '02x') for x in response[0:17]))
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
-                and response[2] == 0x00 and response[3] == 0x0a:
-                data_get_profile[1:15] = response[1:15]
-                # changing bytes
-                data_get_profile[4] = 0x40 + nr
-                vo_set_b = [int(vo_set*1000)%256, int(vo_set*1000)//256]
-                io_set_b = [int(io_set*1000)%256, int(io_set*1000)//256]
-                data_get_profile[6:8] = vo_set_b
-                data_get_profile[8:10] = io_set_b
-                crc = self.modbus_crc(data_get_profile[0:14])
-                data_get_profile[14] = crc[0]
-                data_get_profile[15] = crc[1]
-                device.write(data_get_profile)          # Send the data
-                response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-                return response[4]
-            else:
-                print("Invalid response received")
+        with self.metrics.timer("change_profile"):
+            try:
+                return self.write_profile(nr, 0x40, vo_set=vo_set, io_set=io_set)
+            except Exception as e:
+                print(f"Error: {e}")
+                return None
+
+    def sync_profiles(self, desired, verify=True):
+        """ Bring the profiles to the desired settings with few transfers:
+            all 10 are read once (none if the state cache is fresh), only
+            the profiles that differ are written (one transfer each, no
+            read-modify-write) and read back. desired: {nr: {"vo_set": V, "io_set": A, "ovp_set": V,
+            "ocp_set": A}} or a list of 10 such dicts, settings and
+            profiles left out keep their values. Returns {"changed":
+            [nr, ...], "failed": [nr, ...], "profiles": {nr: profile}},
+            None if the profiles could not be read. """
+        if isinstance(desired, (list, tuple)):
+            desired = dict(enumerate(desired))
+        desired = {int(nr): {name: float(value) for name, value in settings.items()}
+                   for nr, settings in desired.items()}
+        for nr, settings in desired.items():
+            if not 0 <= nr <= 9:
+                raise ValueError(f"no profile {nr}")
+            unknown = set(settings) - set(PROFILE_SETTINGS)
+            if unknown:
+                raise ValueError(f"unknown profile settings {sorted(unknown)}")
+        with self.metrics.timer("sync_profiles"):
+            try:
+                with self.session.lock:
+                    profiles = self.state.all_profiles() or self.read_profiles()
+                    if profiles is None:
+                        return None
+                    changed = []
+                    failed = []
+                    for nr, settings in sorted(desired.items()):
+                        profile = profiles[nr]
+                        target = {**profile, **{name: round(value*1000)/1000
+                                                for name, value in settings.items()}}
+                        if all(round(target[name]*1000) == round(profile[name]*1000)
+                               for name in PROFILE_SETTINGS):
+                            continue
+                        codec.encode_profile(self.profile_frame, 0x40 + nr, profile["state"],
+                                             *(target[name] for name in PROFILE_SETTINGS))
+                        response = self.transfer("profile_write", self.profile_frame)
+                        changed.append(nr)
+                        if protocol.write_ack(response) == 1:
+                            profiles[nr] = target
+                            self.state.written(target, 0x40)
+                        else:
+                            failed.append(nr)
+                    written = [nr for nr in changed if nr not in failed]
+                    if verify and written:
+                        readback = self.read_profiles(written)
+                        for nr in written:
+                            if readback is None or any(
+                                    round(readback[nr][name]*1000) != round(profiles[nr][name]*1000)
+                                    for name in PROFILE_SETTINGS):
+                                failed.append(nr)
+                            if readback is not None:
+                                profiles[nr] = readback[nr]  # what the device holds
+                self.queue_2_gui.put(self.profiles_text(
+                    {nr: list(profile.values()) for nr, profile in profiles.items()}))
+                if failed:
+                    print(f"Profiles {failed} not written")
+                return {"changed": changed, "failed": failed, "profiles": profiles}
+            except Exception as e:
+                print(f"Error: {e}")
                 return None
-            return response[4:14]
-        except Exception as e:
-            print(f"Error: {e}")
-            return None
-        finally:
-            device.close()
 
     def activate_profile(self, nr):
         """ Activate one profile. """
-        data_get_profile = bytearray(64)
-        data_get_profile[0:4] = 0xfb, 0x35, 0x00, 0x01
-        try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            data_get_profile[4] = nr
-            crc = self.modbus_crc(data_get_profile[0:5])
-            data_get_profile[5] = crc[0]
-            data_get_profile[6] = crc[1]
-            device.write(data_get_profile)          # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            #print(' '.join(format(x, '02x') for x in response[0:17]))
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
-                and response[2] == 0x00 and response[3] == 0x0a:
-                data_get_profile[1:15] = response[1:15]
-                # changing bytes
-                data_get_profile[4] = 0xA0 + nr
-                crc = self.modbus_crc(data_get_profile[0:14])
-                data_get_profile[14] = crc[0]
-                data_get_profile[15] = crc[1]
-                device.write(data_get_profile)          # Send the data
-                response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-                return response[4]
-            else:
-                print("Invalid response received")
+        with self.metrics.timer("activate_profile"):
+            try:
+                return self.write_profile(nr, 0xA0)
+            except Exception as e:
+                print(f"Error: {e}")
                 return None
-            return response[4:14]
-        except Exception as e:
-            print(f"Error: {e}")
-            return None
-        finally:
-            device.close()
 
     def on_off(self):
         """ Switch on/off current profile"""
-        answer = self.get_active_profile_info()
-        nr = answer["index"]
-        state = answer["state"]
-        data_get_profile = bytearray(64)
-        data_get_profile[0:4] = 0xfb, 0x35, 0x00, 0x01
-        try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            data_get_profile[4] = nr
-            crc = self.modbus_crc(data_get_profile[0:5])
-            data_get_profile[5] = crc[0]
-            data_get_profile[6] = crc[1]
-            device.write(data_get_profile)          # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            #print(' '.join(format(x, '02x') for x in response[0:17]))
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
-                and response[2] == 0x00 and response[3] == 0x0a:
-                data_get_profile[1:15] = response[1:15]
-                # changing bytes
-                data_get_profile[4] = 0x20 + nr  # 0x20 to switch
+        with self.metrics.timer("on_off"):
+            # the toggle depends on the output state, read it (the front
+            # panel may have switched it), the write uses the cached profile
+            answer = self.get_active_profile_info()
+            if answer is None:
+                return None
+            nr = answer["index"]
+            state = answer["state"]
+            try:
                 if state: # if on
-                    data_get_profile[5] = 0x00 # switch off
-                    #print("we switch off")
+                    answer = self.write_profile(nr, 0x20, state=0x00, active=answer) # switch off
                 else:
-                    data_get_profile[5] = 0x01 # switch on
-                    #print("switch on")
-                crc = self.modbus_crc(data_get_profile[0:14])
-                data_get_profile[14] = crc[0]
-                data_get_profile[15] = crc[1]
-                #print(' '.join(format(x, '02x') for x in data_get_profile[0:17]))
-                device.write(data_get_profile)          # Send the data
-                response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-                if response[4] == 1:    #prepare info for GUI
+                    answer = self.write_profile(nr, 0x20, state=0x01, active=answer) # switch on
+                if answer == 1:    #prepare info for GUI
                     text = "On_off:\n"
                     text += "State: " + str(not state) + "\n"
                     self.queue_2_gui.put(text)
-                return response[4]
-            else:
-                print("Invalid response received")
+                return answer
+            except Exception as e:
+                print(f"Error: {e}")
                 return None
-            return response[4:14]
-        except Exception as e:
-            print(f"Error: {e}")
-            return None
-        finally:
-            device.close()
 
     def off(self):
         """ Switch off current profile"""
-        answer = self.get_active_profile_info()
-        nr = answer["index"]
-        state = answer["state"]
-        data_get_profile = bytearray(64)
-        data_get_profile[0:4] = 0xfb, 0x35, 0x00, 0x01
-        try:
-            device = hid.device()                       # Open the device
-            device.open(self.vendor_id, self.product_id)
-            data_get_profile[4] = nr
-            crc = self.modbus_crc(data_get_profile[0:5])
-            data_get_profile[5] = crc[0]
-            data_get_profile[6] = crc[1]
-            device.write(data_get_profile)          # Send the data
-            response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-            #print(' '.join(format(x, '02x') for x in response[0:17]))
-            if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
-                and response[2] == 0x00 and response[3] == 0x0a:
-                data_get_profile[1:15] = response[1:15]
-                # changing bytes
-                data_get_profile[4] = 0x20 + nr  # 0x20 to switch
-                data_get_profile[5] = 0x00 # switch off
-                #print("we switch off")
-                crc = self.modbus_crc(data_get_profile[0:14])
-                data_get_profile[14] = crc[0]
-                data_get_profile[15] = crc[1]
-                #print(' '.join(format(x, '02x') for x in data_get_profile[0:17]))
-                device.write(data_get_profile)          # Send the data
-                response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
-                if response[4] == 1:    #prepare info for GUI
+        with self.metrics.timer("off"):
+            # read the active profile, the front panel may have switched
+            # to another one since the cache was filled
+            answer = self.get_active_profile_info()
+            if answer is None:
+                return None
+            nr = answer["index"]
+            state = answer["state"]
+            try:
+                answer = self.write_profile(nr, 0x20, state=0x00, active=answer) # switch off
+                if answer == 1:    #prepare info for GUI
                     text = "On_off:\n"
                     text += "State: " + str(not state) + "\n"
                     self.queue_2_gui.put(text)
-                return response[4]
-            else:
-                print("Invalid response received")
+                return answer
+            except Exception as e:
+                print(f"Error: {e}")
                 return None
-            return response[4:14]
-        except Exception as e:
-            print(f"Error: {e}")
-            return None
-        finally:
-            device.close()
 
     def modbus_crc(self, buf):
         """ Calculate modbus crc from a list. LB first!
-            from here: https://github.com/raphaelnunes67/MODBUS-CRC16 """
-        crc = 0xFFFF
-        for i in range(len(buf)):
-            crc ^= buf[i]
-            for bit in range(8):
-                if crc & 0x0001:
-                    crc >>= 1
-                    crc ^= 0xA001
-                else:
-                    crc >>= 1
-        return crc%256, crc//256
+            Table driven, see dp100_protocol.crc16(). """
+        return protocol.modbus_crc(buf)
 
     def create_png_from_csv(self, csv_filename, png_filename):
         """ Reads data from a CSV file and creates a PNG file with a plot of vout and iout over time. """
-        png_width = 15,
-        png_height = 5,
-        timestamps = []
-        vout_values = []
-        iout_values = []
-        try:  # Read data from the CSV file
-            with open(csv_filename, mode="r") as file:
-                reader = csv.reader(file)
-                for row in reader:
-                    if len(row) < 3:
-                        continue  # Skip rows with insufficient data
-                    try:
-                        timestamps.append(datetime.strptime(row[0], "%Y-%m-%dT%H:%M:%S"))
-                        vout_values.append(float(row[1]))
-                        iout_values.append(float(row[2]))
-                    except ValueError:
-                        continue  # Skip rows with invalid data
-        except FileNotFoundError:
+        plot = PlotRenderer(self.png_width, self.png_height, self.plot_decimation)
+        if not os.path.exists(csv_filename):
             print(f"Error: File '{csv_filename}' not found.")
             return
-
-        # Create the plot
-        plt.figure(figsize=(15, 5))
-
-        # Plot Vout on the primary y-axis
-        ax1 = plt.gca()  # Get the current axes
-        ax1.plot(timestamps, vout_values, label="Vout (V)", color="blue", marker="x")
-        ax1.set_xlabel("Time")
-        ax1.set_ylabel("Voltage (V)", color="blue")
-        ax1.tick_params(axis="y", labelcolor="blue")
-        ax1.grid(True)
-        ax1.set_ylim(0, self.max_voltage_axis)  # Set y-axis limits for voltage
-
-        # Create a secondary y-axis for Iout
-        ax2 = ax1.twinx()
-        ax2.plot(timestamps, iout_values, label="Iout (A)", color="red", marker="o")
-        ax2.set_ylabel("Current (A)", color="red")
-        ax2.tick_params(axis="y", labelcolor="red")
-        ax2.set_ylim(0, self.max_current_axis)  # Set y-axis limits for current
-
-        # Add a title and legend
-        plt.title("Vout and Iout Over Time")
-        ax1.legend(loc="upper left")
-        ax2.legend(loc="upper right")
-
-        # Save the plot as a PNG file
-        plt.tight_layout()
-        plt.savefig(png_filename) # Save the plot as a PNG file
-        plt.close()
+        plot.update_from_csv(csv_filename)
+        plot.render(png_filename, self.max_voltage_axis, self.max_current_axis)
         #print(f"Plot saved as '{png_filename}'")
         #prepare info for GUI
         text = "PNG:\n"
         text += "plotted\n"
         self.queue_2_gui.put(text)
 
+    def render_png(self):
+        """ Plot the samples from the ring buffer with the persistent
+            figure and save the PNG. No CSV round trip. """
+        if self.plot is None:
+            self.plot = PlotRenderer(self.png_width, self.png_height, self.plot_decimation)
+        with self.profiler.stage("png_render"):
+            self.plot.update_from_buffer(self.samples)
+            self.plot.render(self.png_filename, self.max_voltage_axis, self.max_current_axis)
+        #prepare info for GUI
+        text = "PNG:\n"
+        text += "plotted\n"
+        self.queue_2_gui.put(text)
+
     def png_creation_thread(self):
-        """Thread-safe wrapper for creating PNG files."""
+        """ Render worker. Blocks on queue_2_png and collapses all pending
+            CREATE_PNG requests into one render of the latest data, so the
+            plot never falls behind when rendering is slow. """
         print("PNG creation thread started.")
         while not self.png_thread_exit_flag:
             try:
-                # Check if there is a message in the queue
-                if not self.queue_2_png.empty():
+                message = self.queue_2_png.get(timeout=1.0)  # exit flag is checked once a second
+            except queue.Empty:
+                continue
+            requests = 0
+            while True:                  # take everything that is waiting
+                if message == "CREATE_PNG":
+                    requests += 1
+                elif message == "EXIT":
+                    self.png_thread_exit_flag = True
+                try:
                     message = self.queue_2_png.get_nowait()
-                    #print(f"PNG thread received message: {message}")
-                    if message == "CREATE_PNG":
-                        #print("Generating PNG...")
-                        self.create_png_from_csv(self.csv_filename, self.png_filename)
-                        #print("PNG generated successfully.")
+                except queue.Empty:
+                    break
+            if requests == 0 or self.png_thread_exit_flag:
+                continue
+            start = perf_counter()
+            try:
+                self.render_png()
             except Exception as e:
                 print(f"Error in PNG creation thread: {e}")
-            sleep(1)  # Prevent busy-waiting
+            duration = perf_counter() - start
+            self.png_stats["renders"] += 1
+            self.png_stats["skipped"] += requests - 1
+            self.png_stats["last_render_s"] = duration
+            self.png_stats["max_render_s"] = max(self.png_stats["max_render_s"], duration)
+            self.png_stats["total_render_s"] += duration
+            self.metrics.observe("dp100_png_render_seconds", duration)
         print("PNG creation thread exiting.")
 
+    def close(self):
+        """ Close the HID session, write the rest of the log file. """
+        self.session.close()
+        with self.log_lock:
+            if self.csv_writer is not None:
+                self.csv_writer.close()
+            if self.capture_writer is not None:
+                self.capture_writer.close()
+
+    def record_sample(self, timestamp, basic_info):
+        """ Store one sample (timestamp from monotonic()) in the ring buffer
+            and the log file (binary capture or CSV, see log_format). """
+        wall_time = time()
+        self.metrics.sample(timestamp)
+        with self.profiler.stage("ring_buffer"):
+            self.samples.append_basic_info(timestamp, basic_info, wall_time)
+        with self.profiler.stage("log_append"), self.log_lock:
+            if self.log_format == "bin":
+                if self.capture_writer is None:
+                    self._start_capture()
+                self.capture_writer.append_basic_info(basic_info, wall_time)
+            else:
+                self.append_csv(basic_info)
+
+    def start_capture(self):
+        """ Start a new binary capture file, export it with
+            dp100_capture.py if CSV is needed. With a segment limit the
+            capture goes to capture_directory and only a new segment is
+            started, the older segments are kept. """
+        with self.log_lock:
+            self._start_capture()
+
+    def _start_capture(self):
+        if self.capture_writer is not None:
+            self.capture_writer.close()
+        if self.segment_seconds is None and self.segment_bytes is None:
+            self.capture_writer = CaptureWriter(self.capture_filename, self.serial_number,
+                                                self.sample_rate)
+        else:
+            self.capture_writer = SegmentedCaptureWriter(
+                self.capture_directory, self.serial_number, self.sample_rate,
+                self.segment_seconds, self.segment_bytes, keep_segments=self.keep_segments)
+
+    def start_log(self):
+        """ Start a new log in log_format, the chart starts over. """
+        if self.log_format == "bin":
+            self.samples.clear()
+            self.start_capture()
+        else:
+            self.create_csv_file()
+
+    def csv_log(self):
+        """ The buffered CSV writer for csv_filename. """
+        if self.csv_writer is None or self.csv_writer.filename != self.csv_filename:
+            if self.csv_writer is not None:
+                self.csv_writer.close()
+            self.csv_writer = CsvLogWriter(self.csv_filename, fsync=self.csv_fsync)
+        return self.csv_writer
+
+    def append_csv(self, basic_info):
+        """ Save vout, iout and current time to the CSV file. """
+        current_time = datetime.now().isoformat(timespec="milliseconds")
+        self.csv_log().write_row([current_time, basic_info["vout"], basic_info["iout"]])
+
     def create_csv_file(self):
-        with open(self.csv_filename, mode="w",newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Timestamp", "Vout (V)", "Iout (A)"])
+        self.samples.clear()         # the chart starts over with the new file
+        with self.log_lock:
+            self.csv_log().reset()
 
 
 
@@ -4,9 +4,13 @@ import tkinter.font as tkFont
 from time import strftime, localtime
 import queue
 from functools import partial # to pass argument from profile buttons
+from dp100_profile import NULL_PROFILER
 
 class GUI:
-    def __init__(self, flags_2_main, queue_2_main, queue_2_gui, png_filename):
+    def __init__(self, flags_2_main, queue_2_main, queue_2_gui, png_filename,
+                 samples=None, decimation="minmax", profiler=NULL_PROFILER):
+        """ With samples (the SampleRingBuffer) the chart is drawn live in
+            the window, else the PNG file is shown after every render. """
         self.standard_font = ["Helvetica", 12, "bold"]
         self.standard_font_big = ["Helvetica", 20, "bold"]
         self.textbox_font = ["Courier", 12, "bold"]
@@ -14,6 +18,13 @@ class GUI:
         self.active_profile = 0
         self.state = 0
         self.png_filename = png_filename
+        self.samples = samples
+        self.decimation = decimation
+        self.profiler = profiler
+        self.live_plot = None        # LivePlot, created in run()
+        self.live_interval = 200     # ms between live plot refreshes
+        self.max_voltage_axis = 10.0
+        self.max_current_axis = 1.0
         self.flags_2_main = flags_2_main
         self.queue_2_main = queue_2_main
         self.queue_2_gui = queue_2_gui
@@ -31,6 +42,7 @@ class GUI:
                                   "Profile Nr" : "Profile Nr:",
                                   "Change_Profile" : "Change Profile",
                                   "Clear PNG": "Reset Chart",
+                                  "Save PNG": "Save Chart as PNG",
                                   "Clear Textwindow" : "Clear Textwindow",
                                   "Quit" : "Quit"
                                  }
@@ -46,8 +58,9 @@ class GUI:
         self.text_win_height = 6
         self.end = END
 
-    def set_flag(self, flag, message):
-        flag.set()
+    def send_command(self, command, message=""):
+        """ Commands go to main_loop through queue_2_main, it wakes up at once. """
+        self.queue_2_main.put(command)
         if message != "":
             self.txt_win.insert(self.end, f"{message}\n")
 
@@ -58,6 +71,10 @@ class GUI:
             if message[0] == "Error:":
                 self.txt_win.insert(self.end, f"{message}\n")
                 self.txt_win.see("end")
+            elif message[0] == "Device:":          # plugged in or removed
+                print(message[1])
+                self.txt_win.insert(self.end, f"{message[1]}\n")
+                self.txt_win.see("end")
             elif message[0] == "Device_info:":
                 text = message[1] + "\n" +  message[2] + "\n" + message[3] + "\n" + message[6] + "\n"
                 print(text)
@@ -89,6 +106,11 @@ class GUI:
                     self.butt_on_off.configure(style="important.TButton", text=self.widget_texts_dict["Off"])
                     self.butt_profiles[self.active_profile].configure(style="important.TButton")
                     text += "The Output is switched OFF\n"
+                vo_set = float(message[3][8:])
+                io_set = float(message[4][8:])
+                if vo_set > 0 and io_set > 0:  # chart limits as in DP100Functions
+                    self.max_voltage_axis = vo_set + vo_set/10
+                    self.max_current_axis = io_set + io_set/10
                 print(text)
                 self.txt_win.insert(self.end, f"{text}\n")
                 self.txt_win.see("end")
@@ -112,10 +134,14 @@ class GUI:
                 print(text)
                 self.txt_win.insert(self.end, f"{text}\n")
             elif message[0] == "PNG:":
-                if message[1] == "plotted":
-                    image = PhotoImage(file=self.png_filename)
-                    self.label_PNG.configure(image = image)
-                    self.label_PNG.image = image
+                if message[1] == "plotted" and self.live_plot is not None:
+                    self.txt_win.insert(self.end, f"Chart saved as {self.png_filename}\n")
+                    self.txt_win.see("end")
+                elif message[1] == "plotted":
+                    with self.profiler.stage("gui_photoimage"):
+                        image = PhotoImage(file=self.png_filename)
+                        self.label_PNG.configure(image = image)
+                        self.label_PNG.image = image
         except queue.Empty:
             pass
         except TclError:
@@ -127,32 +153,48 @@ class GUI:
             if self.mainWin.winfo_exists():
                 self.mainWin.after(100, self.check_queue_from_main)
 
+    def update_live_plot(self):
+        """ Refresh the embedded chart, blits only the two lines. """
+        try:
+            with self.profiler.stage("gui_live_plot"):
+                self.live_plot.refresh(self.max_voltage_axis, self.max_current_axis)
+        except TclError:
+            print("Tcl Error: Cannot update elements.")
+        except Exception as e:
+            print(f"Unexpected error in update_live_plot: {e}")
+        finally:
+            if self.mainWin.winfo_exists():
+                self.mainWin.after(self.live_interval, self.update_live_plot)
+
     def on_butt_connect(self):
-        self.set_flag(self.flags_2_main["flag_connect"], self.widget_texts_dict["Device Information"])
-        self.set_flag(self.flags_2_main["flag_get_basic_info"], self.widget_texts_dict["Basic Information"])
+        self.send_command("connect:", self.widget_texts_dict["Device Information"])
+        self.txt_win.insert(self.end, f"{self.widget_texts_dict['Basic Information']}\n")
         self.txt_win.insert(self.end, f"{self.widget_texts_dict['Profiles']}\n")
         self.butt_connect.configure(style="pressed.TButton", text="Connected")
         self.butt_profiles[self.active_profile].configure(style="important.TButton")
 
     def on_butt_on_off(self):
-        self.set_flag(self.flags_2_main["flag_on_off"], "")
+        self.send_command("on_off:")
 
     def on_butt_change_profile(self):
         p_nr = self.profile_set_nr.get()
         p_v = self.profile_set_v.get()
         p_i = self.profile_set_i.get()
         text = f"change_profile:\n{p_nr}\n{p_v}\n{p_i}"
-        self.queue_2_main.put(text)  # Add the text to queue_2_main flag is set in main
+        self.send_command(text)
         self.txt_win.insert(self.end, f"Setting profile {p_nr} to {p_v} V and {p_i} A\n")
 
     def on_butt_profile_pressed(self,nr):
         print("Profile Nr: ", nr)
         text = f"activate_profile:\n{nr}"
-        self.queue_2_main.put(text)  # Add the text to queue_2_main flag is set in main
+        self.send_command(text)
         self.txt_win.insert(self.end, f"Activating profile {nr}\n")
 
     def on_butt_reset_png(self):
-        self.flags_2_main["flag_reset_png"].set()  # Set flag_reset_png
+        self.send_command("reset_png:")
+
+    def on_butt_save_png(self):
+        self.send_command("save_png:")
 
     def clear_textwindow(self):
         self.txt_win.delete(1.0, END)
@@ -160,6 +202,7 @@ class GUI:
     def on_close(self):
         """Handle GUI close event"""
         self.flags_2_main["flag_exit"].set()  # Set the exit flag
+        self.send_command("exit:")
         self.mainWin.destroy()  # Close the GUI window
 
     def init_ttk_styles(self):
@@ -470,14 +513,21 @@ class GUI:
             self.frame_PNG.columnconfigure(column, weight=10)
         for row in range(1,3):    # 2 rows
             self.frame_PNG.rowconfigure(row, weight=10)
-        #image = PhotoImage(file="idle.png")
-        self.label_PNG = ttk.Label(self.frame_PNG,
-                                   relief='groove',
-                                   padding="10 10 10 10",
-                                   borderwidth = 5,
-                                   #image=image,
-                                   style="default_big.TLabel")
-        self.label_PNG.grid(ipady=self.ipady, column=1, row=1, sticky=(S,W))
+        if self.samples is not None:       # live chart from the ring buffer
+            from dp100_liveplot import LivePlot
+            self.live_plot = LivePlot(self.frame_PNG, self.samples,
+                                      decimation=self.decimation)
+            self.live_plot.widget().grid(column=1, row=1, sticky=(S,W))
+            self.mainWin.after(self.live_interval, self.update_live_plot)
+        else:
+            #image = PhotoImage(file="idle.png")
+            self.label_PNG = ttk.Label(self.frame_PNG,
+                                       relief='groove',
+                                       padding="10 10 10 10",
+                                       borderwidth = 5,
+                                       #image=image,
+                                       style="default_big.TLabel")
+            self.label_PNG.grid(ipady=self.ipady, column=1, row=1, sticky=(S,W))
 
         # frame Textbox +++++++++++++++++++++++++++++++++++++++++++++++++++++++
         self.frame_Textbox = ttk.Frame(self.frame_Main,  style="all.TFrame")
@@ -503,7 +553,7 @@ class GUI:
                                       padding="10 10 10 10", relief='groove',
                                       style="all.TFrame")
         self.frame_Footer.grid(column=1, row=5, columnspan=2,  sticky=(S,W,E))
-        for column in range(1,3): # 2 columns
+        for column in range(1,5): # 4 columns
             self.frame_Footer.columnconfigure(column, weight=1)
         for row in range(1,2):    # 1 rows
             self.frame_Footer.rowconfigure(row, weight=1)
@@ -519,12 +569,18 @@ class GUI:
                                          width=self.button_width_normal,
                                          style="default.TButton")
         self.butt_reset_png.grid(ipady=self.ipady, column=2, row=1, sticky=(W,S))
+        self.butt_save_png = ttk.Button(self.frame_Footer,
+                                        text=self.widget_texts_dict["Save PNG"],
+                                        command=self.on_butt_save_png,
+                                        width=self.button_width_normal,
+                                        style="default.TButton")
+        self.butt_save_png.grid(ipady=self.ipady, column=3, row=1, sticky=(W,S))
         self.butt_quit = ttk.Button(self.frame_Footer,
                                     text=self.widget_texts_dict["Quit"],
                                     command=self.on_close,
                                     width=self.button_width_normal,
                                     style="default.TButton")
-        self.butt_quit.grid(ipady=self.ipady, column=3, row=1,sticky=(S,E))
+        self.butt_quit.grid(ipady=self.ipady, column=4, row=1,sticky=(S,E))
 
         self.UpdateTime()
 
@@ -544,6 +600,8 @@ class GUI:
 
         self.mainWin.mainloop()
 
-def start_gui(flags_2_main, queue_2_main, queue_2_gui, png_filename):
-    gui = GUI(flags_2_main, queue_2_main, queue_2_gui, png_filename)
+def start_gui(flags_2_main, queue_2_main, queue_2_gui, png_filename, samples=None,
+              decimation="minmax", profiler=NULL_PROFILER):
+    gui = GUI(flags_2_main, queue_2_main, queue_2_gui, png_filename, samples, decimation,
+              profiler)
     gui.run()
@@ -0,0 +1,73 @@
+"""  DP100 live plot
+
+    The Vout/Iout chart embedded in the Tk window. It reads the sample
+    ring buffer directly, no PNG file in between. The axes, grid and
+    labels are drawn once into a cached background; a refresh only
+    restores that background, draws the two (animated) lines and blits
+    the figure. A full redraw happens only when the time axis runs out,
+    the y-limits change or the window is resized. """
+
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from dp100_plot import PlotRenderer
+
+class LivePlot(PlotRenderer):
+    def __init__(self, master, samples, width=15, height=5, decimation="minmax",
+                 headroom=0.25):
+        """ master: Tk parent widget, samples: SampleRingBuffer. The time
+            axis is extended by headroom (share of the shown span) so it
+            needs a full redraw only now and then. """
+        super().__init__(width, height, decimation)
+        self.samples = samples
+        self.headroom = headroom
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.line_v.set_animated(True)        # not part of the background
+        self.line_i.set_animated(True)
+        self.figure.tight_layout()
+        self.layout_done = True
+        self.background = None
+        self.y_limits = (None, None)
+        self.full_draws = 0
+        self.blits = 0
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def widget(self):
+        return self.canvas.get_tk_widget()
+
+    def _on_draw(self, event):
+        """ Cache the background after every full draw, then add the lines. """
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_lines()
+        self.full_draws += 1
+
+    def _draw_lines(self):
+        self.ax1.draw_artist(self.line_v)
+        self.ax2.draw_artist(self.line_i)
+
+    def _x_fits(self):
+        """ True if the samples fit the current time axis. """
+        start, end = self.ax1.get_xlim()
+        margin = (end - start)*self.headroom
+        return start <= self.times[0] <= start + margin and self.times[-1] <= end
+
+    def refresh(self, max_voltage_axis, max_current_axis):
+        """ Show the newest samples. Call from the Tk thread. """
+        self.update_from_buffer(self.samples)
+        self.set_lines()
+        redraw = self.background is None
+        if (max_voltage_axis, max_current_axis) != self.y_limits:
+            self.y_limits = (max_voltage_axis, max_current_axis)
+            self.ax1.set_ylim(0, max_voltage_axis)
+            self.ax2.set_ylim(0, max_current_axis)
+            redraw = True
+        if len(self.times) and not self._x_fits():
+            start, end = self.times[0], self.times[-1]
+            span = max(end - start, 10/86400)        # at least 10 s
+            self.ax1.set_xlim(start, end + span*self.headroom)
+            redraw = True
+        if redraw:
+            self.canvas.draw()                   # background and lines, see _on_draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_lines()
+            self.canvas.blit(self.figure.bbox)
+            self.blits += 1
@@ -0,0 +1,116 @@
+"""  DP100 CSV log writer
+
+    Keeps the CSV file open and commits rows in groups: the rows collect
+    in the file buffer and are flushed after flush_rows rows or
+    flush_interval seconds (a timer, also when no more rows come),
+    optionally followed by an fsync. One open/close per session instead
+    of one per sample. """
+
+import os
+import csv
+import threading
+from time import monotonic
+
+class FlushTimer:
+    """ Calls flush interval seconds after it is armed, so buffered rows
+        reach the file also when no more rows come. arm() and cancel()
+        are called with the writer's lock held, flush takes that lock. """
+    def __init__(self, flush, interval):
+        self.flush = flush
+        self.interval = interval
+        self.timer = None
+
+    def arm(self):
+        """ Start the timer unless it is already running. """
+        if self.timer is None:
+            self.timer = threading.Timer(self.interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+class CsvLogWriter:
+    def __init__(self, filename, header=("Timestamp", "Vout (V)", "Iout (A)"),
+                 flush_rows=100, flush_interval=1.0, fsync=False):
+        self.filename = filename
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.file = None
+        self.writer = None
+        self.pending = 0             # rows written since the last flush
+        self.last_flush = monotonic()
+        self.flush_timer = FlushTimer(self.flush, flush_interval)  # rows waiting too long
+        self.lock = threading.Lock()
+
+    def _open(self, truncate):
+        if truncate:
+            self.file = open(self.filename, mode="w", newline="", buffering=65536)
+            csv.writer(self.file).writerow(self.header)
+        else:
+            self._repair()
+            self.file = open(self.filename, mode="a", newline="", buffering=65536)
+        self.writer = csv.writer(self.file)
+        self.pending = 0
+        self.last_flush = monotonic()
+
+    def _repair(self):
+        """ After a crash the last line may be cut off, terminate it so
+            the next row starts on a line of its own. """
+        try:
+            with open(self.filename, mode="rb+") as file:
+                if file.seek(0, os.SEEK_END) == 0:
+                    return
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\r\n")
+        except FileNotFoundError:
+            pass
+
+    def _flush(self):
+        self.flush_timer.cancel()
+        if self.file is not None:
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_flush = monotonic()
+
+    def reset(self):
+        """ Start a new file with only the header. """
+        with self.lock:
+            self._close()
+            self._open(truncate=True)
+            self._flush()
+
+    def write_row(self, row):
+        with self.lock:
+            if self.file is None:
+                self._open(truncate=False)
+            self.writer.writerow(row)
+            self.pending += 1
+            if self.pending >= self.flush_rows or \
+               monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+            else:
+                self.flush_timer.arm()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _close(self):
+        if self.file is not None:
+            self._flush()
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+    def close(self):
+        """ Flush everything that is buffered and close the file. """
+        with self.lock:
+            self._close()
@@ -0,0 +1,189 @@
+"""  DP100 metrics
+
+    Counters, gauges and latency histograms in Prometheus text format.
+    DP100Functions records every command (duration, timeouts, invalid
+    responses, I/O errors), the achieved sample rate, the GUI and PNG
+    queue depths and the PNG render time. Expose them on a local HTTP
+    endpoint or write them to a file for the node exporter's textfile
+    collector:
+
+        dp.metrics.serve_http(9100)            # http://127.0.0.1:9100/metrics
+        dp.metrics.start_textfile("/var/lib/node_exporter/dp100.prom")
+"""
+
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import sleep, monotonic, perf_counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+HELP = {"dp100_command_duration_seconds": ("histogram", "Duration of DP100 commands"),
+        "dp100_command_errors_total": ("counter", "Failed DP100 commands by kind"),
+        "dp100_samples_total": ("counter", "Basic info samples recorded"),
+        "dp100_sample_rate": ("gauge", "Samples per second over the last seconds"),
+        "dp100_queue_depth": ("gauge", "Messages waiting in a queue"),
+        "dp100_png_render_seconds": ("histogram", "Duration of PNG renders"),
+        "dp100_state_cache_total": ("counter", "Device state cache lookups by result")}
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)   # not cumulative, see lines()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{format_labels(labels + (('le', repr(bound)),))} {cumulative}"
+        yield f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {self.count}"
+        yield f"{name}_sum{format_labels(labels)} {self.sum}"
+        yield f"{name}_count{format_labels(labels)} {self.count}"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Metrics:
+    def __init__(self, rate_window=10.0):
+        self.lock = threading.Lock()
+        self.histograms = {}         # (name, labels): Histogram
+        self.counters = {}           # (name, labels): value
+        self.gauges = {}             # (name, labels): function returning the value
+        self.rate_window = rate_window
+        self.sample_times = deque()  # monotonic() of the samples in the window
+        self.gauge("dp100_sample_rate", self.sample_rate)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, function, **labels):
+        """ Register a gauge, function() is called when the metrics are read. """
+        self.gauges[(name, tuple(sorted(labels.items())))] = function
+
+    def command(self, command, seconds, error=None):
+        """ One DP100 command, error: None, "timeout", "invalid" or "io". """
+        self.observe("dp100_command_duration_seconds", seconds, command=command)
+        if error is not None:
+            self.inc("dp100_command_errors_total", command=command, kind=error)
+
+    @contextmanager
+    def timer(self, command):
+        """ Time a block as one command, an exception counts as "io". """
+        start = perf_counter()
+        try:
+            yield
+        except Exception:
+            self.command(command, perf_counter() - start, "io")
+            raise
+        self.command(command, perf_counter() - start)
+
+    def sample(self, timestamp=None):
+        """ Count a sample, timestamp from monotonic(). """
+        if timestamp is None:
+            timestamp = monotonic()
+        self.inc("dp100_samples_total")
+        with self.lock:
+            self.sample_times.append(timestamp)
+            while self.sample_times[0] < timestamp - self.rate_window:
+                self.sample_times.popleft()
+
+    def sample_rate(self):
+        with self.lock:
+            now = monotonic()
+            while self.sample_times and self.sample_times[0] < now - self.rate_window:
+                self.sample_times.popleft()
+            return len(self.sample_times)/self.rate_window
+
+    def render(self):
+        """ All metrics in Prometheus text format. """
+        with self.lock:
+            histograms = [(key, list(histogram.lines(*key)))
+                          for key, histogram in self.histograms.items()]
+            counters = list(self.counters.items())
+        gauges = []
+        for key, function in list(self.gauges.items()):
+            try:
+                gauges.append((key, function()))
+            except Exception:
+                pass
+        lines = []
+        described = set()
+        def describe(name):
+            if name not in described and name in HELP:
+                kind, text = HELP[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+        for (name, labels), histogram_lines in sorted(histograms):
+            describe(name)
+            lines.extend(histogram_lines)
+        for (name, labels), value in sorted(counters):
+            describe(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges, key=lambda item: item[0]):
+            describe(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, filename):
+        """ Replace filename atomically with the current metrics. """
+        with open(filename + ".tmp", "w") as file:
+            file.write(self.render())
+        os.replace(filename + ".tmp", filename)
+
+    def start_textfile(self, filename, interval=10.0):
+        """ Write the metrics file every interval seconds (daemon thread). """
+        def run():
+            while True:
+                try:
+                    self.write_textfile(filename)
+                except OSError as e:
+                    print(f"Error writing metrics: {e}")
+                sleep(interval)
+        threading.Thread(target=run, name="dp100-metrics-file", daemon=True).start()
+
+    def serve_http(self, port, host="127.0.0.1"):
+        """ Serve GET /metrics on a daemon thread, returns the server. """
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass                         # no line per scrape
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="dp100-metrics-http",
+                         daemon=True).start()
+        return server
@@ -0,0 +1,162 @@
+"""  DP100 bank of units
+
+    Control and telemetry for several DP100s side by side. Every unit gets
+    its own DP100Session (own HID handle, chosen by serial number or path),
+    its own DP100Functions with ring buffer and capture file, and its own
+    polling thread. hidapi releases the GIL while it waits on USB, so a slow
+    round trip on one supply does not hold up the others and the total
+    sample rate grows with the number of units:
+
+        bank = DP100Bank.connected(rate=50)
+        bank.start()
+        bank["1A2B3C4D"].on_off()
+        ...
+        bank.stop()
+
+        python dp100_multi.py --list
+        python dp100_multi.py --rate 50 --duration 3600
+"""
+
+import queue
+import argparse
+import threading
+from time import sleep, monotonic
+from dp100_functions import DP100Functions, DiscardQueue
+from dp100_session import DP100Session, enumerate_devices
+from dp100_discovery import DeviceDiscovery
+from dp100_emulator import DP100Emulator
+from dp100_protocol import VENDOR_ID, PRODUCT_ID
+
+class DP100Bank:
+    def __init__(self, sessions, rate=None, sample_capacity=100000, discovery=None):
+        """ sessions: {name: DP100Session}, the name (serial number or path)
+            also names the log files of the unit. rate: samples per second
+            and unit, None or 0 for as fast as possible. A discovery is
+            stopped together with the bank. """
+        self.rate = rate
+        self.discovery = discovery
+        self.units = {}
+        for name, session in sessions.items():
+            dp = DP100Functions(queue.Queue(), DiscardQueue(), queue.Queue(), session,
+                                sample_capacity)
+            dp.csv_filename = f"dp100_vi_data_{name}.csv"
+            dp.capture_filename = f"dp100_vi_data_{name}.dp100"
+            dp.capture_directory = f"dp100_capture_{name}"
+            dp.png_filename = f"dp100_vi_data_{name}.png"
+            dp.sample_rate = rate or 0.0
+            self.units[name] = dp
+        self.counts = {name: 0 for name in self.units}  # samples since start()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    @classmethod
+    def connected(cls, serial_numbers=None, vendor_id=VENDOR_ID, product_id=PRODUCT_ID,
+                  **kwargs):
+        """ Bank of all connected units, or only those with the given
+            HID serial numbers. A DeviceDiscovery watches for units that
+            are unplugged and plugged in again. """
+        discovery = DeviceDiscovery(vendor_id, product_id)
+        sessions = {}
+        for device_dict in discovery.devices.values():
+            serial_number = device_dict.get("serial_number") or ""
+            if serial_numbers is not None and serial_number not in serial_numbers:
+                continue
+            if serial_number:            # found again under a new path after a replug
+                session = DP100Session(vendor_id, product_id, serial_number=serial_number,
+                                       discovery=discovery)
+                name = serial_number
+            else:
+                session = DP100Session(vendor_id, product_id, path=device_dict["path"],
+                                       discovery=discovery)
+                name = device_dict["path"].decode(errors="replace").replace("/", "_")
+            sessions[name] = session
+        discovery.start()
+        return cls(sessions, discovery=discovery, **kwargs)
+
+    @classmethod
+    def emulated(cls, units, latency=0.002, **kwargs):
+        """ Bank of software emulators, serial numbers 00000001, 00000002, ... """
+        sessions = {}
+        for i in range(units):
+            serial_number = f"{i + 1:08d}"
+            emulator = DP100Emulator(latency=latency, serial_number=serial_number)
+            sessions[serial_number] = DP100Session(VENDOR_ID, PRODUCT_ID,
+                                                   device_factory=emulator,
+                                                   serial_number=serial_number)
+        return cls(sessions, **kwargs)
+
+    def __getitem__(self, name):
+        """ DP100Functions of one unit, for commands. """
+        return self.units[name]
+
+    def __len__(self):
+        return len(self.units)
+
+    def start(self, on_sample=None):
+        """ Read the device info (starts the log of every unit) and start
+            one polling thread per unit. on_sample(name, timestamp,
+            basic_info) is called from the polling threads. """
+        self.stop_event.clear()
+        for name, dp in self.units.items():
+            dp.get_device_info()
+            thread = threading.Thread(target=self._poll, args=(name, dp, on_sample),
+                                      name=f"dp100-{name}", daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def _poll(self, name, dp, on_sample):
+        for timestamp, basic_info in dp.stream_basic_info(self.rate, self.stop_event):
+            dp.record_sample(timestamp, basic_info)
+            self.counts[name] += 1
+            if on_sample is not None:
+                on_sample(name, timestamp, basic_info)
+
+    def stop(self):
+        """ Stop polling, close all handles and logs. """
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for dp in self.units.values():
+            dp.close()
+        if self.discovery is not None:
+            self.discovery.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll several DP100 units at once")
+    parser.add_argument("--list", action="store_true", help="list the connected units and exit")
+    parser.add_argument("--serial", action="append", metavar="SN",
+                        help="only this unit (repeat for more), default all")
+    parser.add_argument("--rate", type=float, default=1.0, metavar="HZ",
+                        help="samples per second and unit, 0 for as fast as possible (default 1)")
+    parser.add_argument("--duration", type=float, metavar="S", help="stop after S seconds")
+    parser.add_argument("--emulator", type=int, default=0, metavar="N",
+                        help="use N software emulators instead of USB devices")
+    parser.add_argument("--emulator-latency", type=float, default=0.002, metavar="S",
+                        help="emulator response time in seconds (default 0.002)")
+    args = parser.parse_args()
+    if args.list:
+        for device_dict in enumerate_devices(VENDOR_ID, PRODUCT_ID):
+            print(f"{device_dict.get('serial_number')} : {device_dict['path']}")
+        return
+    if args.emulator:
+        bank = DP100Bank.emulated(args.emulator, args.emulator_latency, rate=args.rate)
+    else:
+        bank = DP100Bank.connected(args.serial, rate=args.rate)
+    if len(bank) == 0:
+        print("No DP100 found")
+        return
+    print(f"Polling {', '.join(bank.units)}")
+    bank.start()
+    start = monotonic()
+    try:
+        while args.duration is None or monotonic() - start < args.duration:
+            sleep(1.0)
+            elapsed = monotonic() - start
+            print(" ".join(f"{name}: {count/elapsed:.1f}/s" for name, count in bank.counts.items()))
+    except KeyboardInterrupt:
+        print("Keyboard interrupt by user")
+    bank.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""  DP100 plot
+
+    Incremental Vout/Iout plot. The figure, both axes and the two lines
+    are created once and kept alive; every frame only updates the line
+    data (from the sample ring buffer or new CSV lines), rescales the axes
+    and encodes the PNG. Long series are decimated to about the pixel
+    width of the figure first (see dp100_decimate). """
+
+from datetime import datetime
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+from dp100_ringbuffer import INDEX
+from dp100_decimate import decimate
+
+class PlotRenderer:
+    def __init__(self, width=15, height=5, decimation="minmax", max_markers=200):
+        """ decimation: "minmax", "lttb" or None. Markers are only drawn
+            for up to max_markers points. """
+        self.decimation = decimation
+        self.max_markers = max_markers
+        self.figure = Figure(figsize=(width, height))
+        FigureCanvasAgg(self.figure)
+        # Plot Vout on the primary y-axis
+        self.ax1 = self.figure.add_subplot()
+        self.line_v, = self.ax1.plot([], [], label="Vout (V)", color="blue", marker="x")
+        self.ax1.set_xlabel("Time")
+        self.ax1.set_ylabel("Voltage (V)", color="blue")
+        self.ax1.tick_params(axis="y", labelcolor="blue")
+        self.ax1.grid(True)
+        self.ax1.xaxis_date()
+        # Create a secondary y-axis for Iout
+        self.ax2 = self.ax1.twinx()
+        self.line_i, = self.ax2.plot([], [], label="Iout (A)", color="red", marker="o")
+        self.ax2.set_ylabel("Current (A)", color="red")
+        self.ax2.tick_params(axis="y", labelcolor="red")
+        # Add a title and legend
+        self.ax1.set_title("Vout and Iout Over Time")
+        self.ax1.legend(loc="upper left")
+        self.ax2.legend(loc="upper right")
+        self.layout_done = False
+        self.clear()
+
+    def clear(self):
+        """ Forget all samples. """
+        self.times = []    # matplotlib date numbers
+        self.vout = []
+        self.iout = []
+        self.csv_offset = 0
+
+    def append(self, time, vout, iout):
+        """ Add one sample, time as datetime. """
+        self.times.append(mdates.date2num(time))
+        self.vout.append(vout)
+        self.iout.append(iout)
+
+    def update_from_buffer(self, samples, last=None):
+        """ Take the newest samples from a SampleRingBuffer (no CSV, no
+            parsing). Returns the number of samples shown. """
+        data = samples.view(last)
+        wall_time = data[INDEX["wall_time"]]
+        if len(wall_time):                # epoch seconds to local date numbers
+            offset = mdates.date2num(datetime.fromtimestamp(wall_time[-1])) - wall_time[-1]/86400
+            self.times = wall_time/86400 + offset
+        else:
+            self.times = wall_time
+        self.vout = data[INDEX["vout"]]
+        self.iout = data[INDEX["iout"]]
+        return len(wall_time)
+
+    def update_from_csv(self, csv_filename):
+        """ Parse only the lines added to the CSV file since the last call.
+            Returns the number of new samples. """
+        try:
+            with open(csv_filename, mode="rb") as file:
+                file.seek(self.csv_offset)
+                data = file.read()
+        except FileNotFoundError:
+            print(f"Error: File '{csv_filename}' not found.")
+            return 0
+        end = data.rfind(b"\n") + 1       # an incomplete last line waits
+        self.csv_offset += end
+        times = []
+        for line in data[:end].decode().splitlines():
+            row = line.split(",")
+            if len(row) < 3:
+                continue  # Skip rows with insufficient data
+            try:
+                time, vout, iout = datetime.fromisoformat(row[0]), float(row[1]), float(row[2])
+            except ValueError:
+                continue  # Skip header and rows with invalid data
+            times.append(time)
+            self.vout.append(vout)
+            self.iout.append(iout)
+        if times:
+            self.times.extend(mdates.date2num(times).tolist())  # one call for all rows
+        return len(times)
+
+    def set_lines(self):
+        """ Hand the (decimated) samples to the two lines. """
+        points = int(self.figure.bbox.width)  # pixel width
+        self.line_v.set_data(*decimate(self.times, self.vout, points, self.decimation))
+        self.line_i.set_data(*decimate(self.times, self.iout, points, self.decimation))
+        markers = len(self.times) <= self.max_markers
+        self.line_v.set_marker("x" if markers else "None")
+        self.line_i.set_marker("o" if markers else "None")
+
+    def render(self, png_filename, max_voltage_axis, max_current_axis):
+        """ Update the lines and axes and save the PNG file. """
+        self.set_lines()
+        if len(self.times):
+            start, end = self.times[0], self.times[-1]
+            if start == end:
+                start, end = start - 1/86400, end + 1/86400  # +-1 s
+            self.ax1.set_xlim(start, end)
+        self.ax1.set_ylim(0, max_voltage_axis)  # Set y-axis limits for voltage
+        self.ax2.set_ylim(0, max_current_axis)  # Set y-axis limits for current
+        if not self.layout_done:             # layout once, not every frame
+            self.figure.tight_layout()
+            self.layout_done = True
+        self.figure.savefig(png_filename)
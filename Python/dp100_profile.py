@@ -0,0 +1,137 @@
+"""  DP100 profiling mode
+
+    StageProfiler times the stages of a sample tick (HID write and read,
+    decode, ring buffer, log append, GUI text, PNG render, live plot) and
+    prints a breakdown every interval seconds. It can also run every
+    thread under cProfile and write one combined pstats file at the end:
+
+        python dp100.py --profile 10 --profile-out dp100.pstats
+        python -m pstats dp100.pstats
+
+    Without --profile the code uses NULL_PROFILER, whose stages cost one
+    attribute lookup and an empty with block. """
+
+import sys
+import cProfile
+import pstats
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.name, perf_counter() - self.start)
+
+class NullProfiler:
+    """ Profiling off. """
+    _stage = nullcontext()
+
+    def stage(self, name):
+        return self._stage
+
+NULL_PROFILER = NullProfiler()
+
+# Up to 3.11 a cProfile.Profile only sees the thread that enabled it.
+# From 3.12 it runs on sys.monitoring: it sees all threads, and only one
+# may be active in the process.
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+class StageProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}             # name: [calls, total s, max s] since the last report
+        self.window_start = perf_counter()
+        self.profiles = []           # cProfile.Profile per wrapped thread (one from 3.12)
+
+    def stage(self, name):
+        """ Context manager timing one pass through a stage. """
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                stage[0] += 1
+                stage[1] += seconds
+                if seconds > stage[2]:
+                    stage[2] = seconds
+
+    def snapshot(self, reset=True):
+        """ {stage: {calls, total_s, mean_s, max_s, share}} for the time
+            since the last reset, share of the wall clock time. """
+        with self.lock:
+            now = perf_counter()
+            window = now - self.window_start
+            stages = self.stages
+            if reset:
+                self.stages = {}
+                self.window_start = now
+        return {name: {"calls": calls, "total_s": total, "mean_s": total/calls,
+                       "max_s": maximum, "share": total/window if window else 0.0,
+                       "calls_per_s": calls/window if window else 0.0}
+                for name, (calls, total, maximum) in stages.items()}
+
+    def report(self, reset=True):
+        """ The snapshot as a table, slowest stage first. """
+        stages = self.snapshot(reset)
+        lines = [f"{'stage':<16}{'calls/s':>10}{'mean us':>10}{'max us':>10}{'share':>8}"]
+        for name, stage in sorted(stages.items(), key=lambda item: -item[1]["total_s"]):
+            lines.append(f"{name:<16}{stage['calls_per_s']:>10.1f}{stage['mean_s']*1e6:>10.1f}"
+                         f"{stage['max_s']*1e6:>10.1f}{stage['share']*100:>7.1f}%")
+        return "\n".join(lines)
+
+    def start_reporting(self, interval, stop_event):
+        """ Print a report every interval seconds until stop_event is set. """
+        def run():
+            while not stop_event.wait(interval):
+                print("Profile:\n" + self.report())
+        thread = threading.Thread(target=run, name="dp100-profile", daemon=True)
+        thread.start()
+        return thread
+
+    def profile_thread(self, target):
+        """ Wrap a thread target so it runs under cProfile, with its own
+            profiler up to Python 3.11. From 3.12 the first call enables
+            one profiler for the whole process and target is returned
+            as it is. """
+        if not PER_THREAD_PROFILES:
+            with self.lock:
+                if not self.profiles:
+                    profile = cProfile.Profile()
+                    profile.enable()
+                    self.profiles.append(profile)
+            return target
+        def run(*args, **kwargs):
+            profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+            profile.enable()
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profile.disable()
+        return run
+
+    def dump_stats(self, filename):
+        """ Write the cProfile data of all wrapped threads to one file. """
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return
+        if not PER_THREAD_PROFILES:
+            profiles[0].disable()
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(filename)
@@ -0,0 +1,80 @@
+"""  DP100 protocol: Modbus CRC and prebuilt request frames """
+
+VENDOR_ID = 0x2e3c
+PRODUCT_ID = 0xaf01
+FRAME_SIZE = 64
+HEADER_REQUEST = 0xfb
+HEADER_RESPONSE = 0xfa
+CMD_DEVICE_INFO = 0x10
+CMD_BASIC_INFO = 0x30
+CMD_PROFILE = 0x35
+ACTIVE_PROFILE = 0x80  # profile index used to read the active profile
+
+def _make_crc_table():
+    """ 256 entries, one for every value of the low CRC byte. """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = _make_crc_table()
+
+def crc16(buf, crc=0xFFFF):
+    """ Modbus CRC16 of buf. Pass the result of a previous call as crc
+        to continue the calculation over more data. """
+    table = CRC_TABLE
+    for byte in buf:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+def modbus_crc(buf):
+    """ Modbus CRC as (low byte, high byte). LB first! """
+    crc = crc16(buf)
+    return crc & 0xFF, crc >> 8
+
+def build_request(command, payload=b""):
+    """ Build a 64-byte request frame with the CRC behind the payload. """
+    frame = bytearray(FRAME_SIZE)
+    length = len(payload)
+    frame[0:4] = HEADER_REQUEST, command, 0x00, length
+    frame[4:4+length] = payload
+    frame[4+length:6+length] = modbus_crc(frame[0:4+length])
+    return frame
+
+# Static requests, built once. bytes so nobody can modify them by accident.
+REQUEST_DEVICE_INFO = bytes(build_request(CMD_DEVICE_INFO))
+REQUEST_BASIC_INFO = bytes(build_request(CMD_BASIC_INFO))
+REQUEST_ACTIVE_PROFILE = bytes(build_request(CMD_PROFILE, bytes([ACTIVE_PROFILE])))
+REQUEST_PROFILE = tuple(bytes(build_request(CMD_PROFILE, bytes([nr])))
+                        for nr in range(10))
+
+def response_matches(request, response):
+    """ True if response can be the answer to request: response header,
+        same command and for profiles the same kind of frame (a read
+        answers with the requested profile, a write with a 1 byte ack).
+        Anything else is a late answer to an earlier request. """
+    if len(response) < 5 or response[0] != HEADER_RESPONSE or response[1] != request[1]:
+        return False
+    if request[1] == CMD_PROFILE:
+        if request[3] != 1:                   # write, answered by the ack
+            return response[3] == 1
+        if response[3] == 1:
+            return False
+        if request[4] == ACTIVE_PROFILE:
+            return response[4] < 10
+        return response[4] == request[4]
+    return True
+
+def write_ack(response):
+    """ Answer byte of a profile write ack (1 = ok), None if response is
+        not an ack frame. """
+    if len(response) < 5 or response[0] != HEADER_RESPONSE or \
+       response[1] != CMD_PROFILE or response[3] != 1:
+        return None
+    return response[4]
@@ -0,0 +1,243 @@
+"""  DP100 HID record and replay
+
+    HIDRecorder wraps the real hid.device (or the emulator) and writes every
+    64-byte request/response pair with its timing to a transfer file.
+    HIDReplay plays such a file back to DP100Functions without hardware,
+    in real time, faster (speed > 1) or as fast as possible (speed 0), so
+    a slow bench session can be reproduced and profiled offline:
+
+        recorder = HIDRecorder("bench.dp100hid")
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=recorder)
+        ...
+        replay = HIDReplay("bench.dp100hid", speed=0)
+        session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=replay)
+
+        python dp100.py --record bench.dp100hid
+        python dp100.py --replay bench.dp100hid --replay-speed 10 --profile 5
+        python dp100_replay.py info bench.dp100hid
+
+    Transfer file: 32-byte header (magic, version, record size, start time)
+    followed by fixed size records (time of the request since the start,
+    response time, response length, request, response). A response length
+    of 0 is a read that timed out. """
+
+import os
+import struct
+import argparse
+import threading
+from time import time, sleep, monotonic
+from dp100_protocol import FRAME_SIZE
+
+MAGIC = b"DP100HID"
+VERSION = 1
+HEADER = struct.Struct("<8sHHd12x")               # 32 bytes
+RECORD = struct.Struct(f"<dfB{FRAME_SIZE}s{FRAME_SIZE}s")
+
+class RecordingDevice:
+    """ hid.device stand-in passing everything through to device and
+        recording each write/read pair. """
+    def __init__(self, device, recorder):
+        self.device = device
+        self.recorder = recorder
+        self.request = None
+        self.request_time = 0.0
+
+    def open(self, *args, **kwargs):
+        return self.device.open(*args, **kwargs)
+
+    def open_path(self, path):
+        return self.device.open_path(path)
+
+    def close(self):
+        return self.device.close()
+
+    def write(self, data):
+        self.request = bytes(data)
+        self.request_time = monotonic()
+        return self.device.write(data)
+
+    def read(self, max_length, timeout_ms=0):
+        response = self.device.read(max_length, timeout_ms=timeout_ms)
+        if self.request is not None:
+            self.recorder.add(self.request_time, monotonic() - self.request_time,
+                              self.request, bytes(response))
+            self.request = None
+        return response
+
+    def __getattr__(self, name):       # get_serial_number_string() and friends
+        return getattr(self.device, name)
+
+class HIDRecorder:
+    def __init__(self, filename, device_factory=None):
+        """ device_factory for DP100Session, recording to filename (an
+            existing file is replaced). device_factory: the real one,
+            default hid.device. """
+        if device_factory is None:
+            import hid
+            device_factory = hid.device
+        self.filename = filename
+        self.device_factory = device_factory
+        self.lock = threading.Lock()
+        self.records = 0
+        self.start = monotonic()
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time()))
+
+    def __call__(self):
+        return RecordingDevice(self.device_factory(), self)
+
+    def add(self, request_time, duration, request, response):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(request_time - self.start, duration,
+                                        len(response), request, response))
+            self.records += 1
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_transfers(filename):
+    """ Header dict and list of (time, duration, request, response) of a
+        transfer file, response b"" for a timeout. """
+    with open(filename, "rb") as file:
+        data = file.read()
+    magic, version, record_size, start_time = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"{filename} is not a DP100 transfer file")
+    end = HEADER.size + (len(data) - HEADER.size)//RECORD.size*RECORD.size  # drop a torn record
+    transfers = [(request_time, duration, request, response[:length])
+                 for request_time, duration, length, request, response
+                 in RECORD.iter_unpack(data[HEADER.size:end])]
+    return {"start_time": start_time, "transfers": len(transfers)}, transfers
+
+class HIDReplay:
+    def __init__(self, filename, speed=1.0, loop=False):
+        """ device_factory for DP100Session answering from a transfer file.
+            speed: 1 real time, 2 twice as fast, 0 as fast as possible,
+            loop: start again at the end, else every request after the
+            end raises OSError and finished is set.
+            A request that differs from the recorded one is answered with
+            the next recorded transfer of the same request (mismatches
+            counts the skipped ones), or times out if there is none. """
+        self.header, self.transfers = read_transfers(filename)
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.mismatches = 0
+        self.pending = None          # (duration, response) of the last write
+        self.start = None            # monotonic() of the first request
+        self.offset = 0.0            # recording time of the first request
+        self.finished = threading.Event()
+        self.is_open = False
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def open(self, vendor_id=None, product_id=None, serial_number=None):
+        self.is_open = True
+
+    def open_path(self, path):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.pending = None
+
+    def _next(self, request):
+        """ Recorded transfer answering request, None if there is none. """
+        if self.position >= len(self.transfers) and self.loop and self.transfers:
+            self.position = 0
+            self.start = None
+        for position in range(self.position, len(self.transfers)):
+            transfer = self.transfers[position]
+            if transfer[2] == request:
+                self.mismatches += position - self.position
+                self.position = position + 1
+                return transfer
+        self.mismatches += 1
+        return None
+
+    def write(self, data):
+        if not self.is_open:
+            raise ValueError("not open")
+        request = bytes(data).ljust(FRAME_SIZE, b"\x00")
+        with self.lock:
+            if self.position >= len(self.transfers) and not self.loop:
+                self.finished.set()
+                raise OSError("end of recording")
+            transfer = self._next(request)
+            if transfer is None:
+                self.pending = (self.transfers[-1][1] if self.transfers else 0.0, b"")
+                return len(data)
+            request_time, duration, _, response = transfer
+            if self.start is None:
+                self.start = monotonic()
+                self.offset = request_time
+            due = self.start + (request_time - self.offset)/self.speed if self.speed else 0.0
+            self.pending = (duration, response)
+        if self.speed:               # not before the recorded request time
+            delay = due - monotonic()
+            if delay > 0:
+                sleep(delay)
+        return len(data)
+
+    def read(self, max_length, timeout_ms=0):
+        if not self.is_open:
+            raise ValueError("not open")
+        with self.lock:
+            pending, self.pending = self.pending, None
+        if pending is None:
+            return []
+        duration, response = pending
+        if self.speed:
+            sleep(duration/self.speed)
+        return list(response[:max_length])
+
+    def get_manufacturer_string(self):
+        return "ALIENTEK"
+
+    def get_product_string(self):
+        return "ATK-MDP100"
+
+    def get_serial_number_string(self):
+        return ""
+
+def info(filename):
+    """ Summary of a transfer file. """
+    header, transfers = read_transfers(filename)
+    commands = {}
+    for _, duration, request, response in transfers:
+        stats = commands.setdefault(request[1], [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        stats[3] += not response
+    print(f"{filename}: {header['transfers']} transfers, "
+          f"{os.path.getsize(filename)} bytes, started {header['start_time']:.3f}")
+    if transfers:
+        print(f"Duration: {transfers[-1][0] - transfers[0][0]:.3f} s")
+    for command, (calls, total, maximum, timeouts) in sorted(commands.items()):
+        print(f"  0x{command:02X}: {calls} transfers, mean {total/calls*1000:.3f} ms, "
+              f"max {maximum*1000:.3f} ms, {timeouts} timeouts")
+
+def main():
+    parser = argparse.ArgumentParser(description="DP100 HID transfer files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info_parser = sub.add_parser("info", help="summary of a transfer file")
+    info_parser.add_argument("filename")
+    args = parser.parse_args()
+    if args.command == "info":
+        info(args.filename)
+
+if __name__ == '__main__':
+    main()
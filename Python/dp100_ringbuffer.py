@@ -0,0 +1,81 @@
+"""  DP100 sample ring buffer
+
+    Fixed-capacity, numpy-backed store of the most recent samples. It is
+    filled by the acquisition path; plot, GUI and statistics read from it
+    instead of re-reading the CSV file. Memory use is fixed by capacity. """
+
+import threading
+from time import time
+import numpy as np
+
+FIELDS = ("time", "wall_time", "vout", "iout", "vin", "temp1", "temp2")
+INDEX = {name: i for i, name in enumerate(FIELDS)}
+
+class SampleRingBuffer:
+    def __init__(self, capacity=100000):
+        """ time: time.monotonic(), wall_time: time.time() (epoch),
+            one row per field, one column per sample. """
+        self.capacity = capacity
+        self.data = np.zeros((len(FIELDS), capacity))
+        self.count = 0                # samples appended since the last clear
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+
+    def append(self, timestamp, wall_time, vout, iout, vin, temp1, temp2):
+        with self.lock:
+            self.data[:, self.count % self.capacity] = (timestamp, wall_time, vout,
+                                                        iout, vin, temp1, temp2)
+            self.count += 1
+
+    def append_basic_info(self, timestamp, basic_info, wall_time=None):
+        """ Add a sample from a basic info dict, timestamp from monotonic(). """
+        if wall_time is None:
+            wall_time = time()
+        self.append(timestamp, wall_time, basic_info["vout"], basic_info["iout"],
+                    basic_info["vin"], basic_info["temp1"], basic_info["temp2"])
+
+    def segments(self, last=None):
+        """ The newest last samples (default all) in time order as a list of
+            at most two views into the buffer, no copy. The views stay
+            valid until the writer wraps around onto them. """
+        with self.lock:
+            count = self.count
+        size = min(count, self.capacity)
+        if last is not None:
+            size = min(size, last)
+        end = count % self.capacity
+        start = end - size
+        if size == 0:
+            return []
+        if start >= 0 and end > 0:
+            return [self.data[:, start:end]]
+        if end == 0:                             # ends exactly at the wrap
+            return [self.data[:, self.capacity - size:]]
+        return [self.data[:, self.capacity + start:], self.data[:, :end]]
+
+    def view(self, last=None):
+        """ The newest last samples as one (fields x samples) array.
+            A view if the samples do not wrap around, else a copy. """
+        parts = self.segments(last)
+        if not parts:
+            return self.data[:, 0:0]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts, axis=1)
+
+    def column(self, name, last=None):
+        return self.view(last)[INDEX[name]]
+
+    def statistics(self, name, last=None):
+        """ min, max and mean of one field over the newest last samples. """
+        values = self.column(name, last)
+        if len(values) == 0:
+            return None
+        return {"min": float(values.min()), "max": float(values.max()),
+                "mean": float(values.mean())}
@@ -0,0 +1,264 @@
+"""  DP100 sequence engine
+
+    Timed setpoint sequences for automated tests: steps, ramps, dwell
+    times, output on/off and loops, given as a list of dicts (or a JSON
+    file):
+
+        [{"set": {"vo_set": 5.0, "io_set": 0.5}},
+         {"output": 1},
+         {"dwell": 2.0},
+         {"ramp": {"vo_set": 12.0}, "duration": 5.0, "interval": 0.1},
+         {"loop": [{"set": {"vo_set": 3.3}}, {"dwell": 1.0},
+                   {"set": {"vo_set": 5.0}}, {"dwell": 1.0}], "count": 10},
+         {"output": 0}]
+
+    set, ramp and output steps take an optional "dwell" after them.
+
+    The sequence is compiled to setpoint events with offsets from the start
+    and every event is due at start + offset (monotonic clock), so a late
+    write never shifts the ones after it. One thread runs the setpoints
+    and the telemetry on their own absolute schedules: a sample that would
+    still be on the bus when a setpoint is due waits until after it, and
+    missed sample slots are skipped, not caught up. The report compares
+    actual and planned times:
+
+        runner = SequenceRunner(dp, sequence, sample_rate=20)
+        report = runner.run()
+
+        python dp100_sequence.py test.json --emulator --rate 20
+"""
+
+import json
+import queue
+import argparse
+import threading
+from time import monotonic, perf_counter
+from dp100_functions import DP100Functions, DiscardQueue
+from dp100_session import DP100Session
+from dp100_emulator import DP100Emulator
+from dp100_protocol import VENDOR_ID, PRODUCT_ID
+
+SETPOINTS = ("vo_set", "io_set")
+
+def compile_sequence(sequence, vo_set=0.0, io_set=0.0):
+    """ Flat list of events (offset s, {"vo_set": V, "io_set": A} or
+        {"output": 0/1}) and the total duration. vo_set, io_set: the
+        settings before the sequence, where ramps start. Raises
+        ValueError for an unknown step. """
+    events = []
+    current = {"vo_set": float(vo_set), "io_set": float(io_set)}
+
+    def add(steps, offset):
+        for step in steps:
+            if "set" in step:
+                settings = setpoints(step["set"])
+                current.update(settings)
+                events.append((offset, settings))
+                offset += float(step.get("dwell", 0.0))
+            elif "ramp" in step:
+                target = setpoints(step["ramp"])
+                duration = float(step["duration"])
+                interval = float(step.get("interval", 0.1))
+                if duration <= 0 or interval <= 0:
+                    raise ValueError("ramp needs a positive duration and interval")
+                start = dict(current)
+                points = max(1, round(duration/interval))
+                for i in range(1, points + 1):
+                    settings = {name: round(start[name] + (value - start[name])*i/points, 3)
+                                for name, value in target.items()}
+                    events.append((offset + duration*i/points, settings))
+                current.update(target)
+                offset += duration + float(step.get("dwell", 0.0))
+            elif "output" in step:
+                events.append((offset, {"output": 1 if step["output"] else 0}))
+                offset += float(step.get("dwell", 0.0))
+            elif "loop" in step:
+                for _ in range(int(step.get("count", 1))):
+                    offset = add(step["loop"], offset)
+            elif "dwell" in step:
+                offset += float(step["dwell"])
+            else:
+                raise ValueError(f"unknown sequence step {step}")
+        return offset
+
+    duration = add(sequence, 0.0)
+    return events, duration
+
+def setpoints(settings):
+    unknown = set(settings) - set(SETPOINTS)
+    if unknown:
+        raise ValueError(f"unknown setpoints {sorted(unknown)}")
+    return {name: float(value) for name, value in settings.items()}
+
+def timing(values):
+    """ Count, mean, p99 and max of a list of seconds, in ms. """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {"count": len(values),
+            "mean_ms": sum(values)/len(values)*1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(0.99*(len(ordered) - 1)))]*1000,
+            "max_ms": ordered[-1]*1000}
+
+class SequenceRunner:
+    def __init__(self, dp, sequence, sample_rate=10.0, profile=None, lead=0.1):
+        """ dp: DP100Functions, sequence: list of steps (see above),
+            sample_rate: telemetry samples per second (0: none), profile:
+            profile nr to activate first, default the active one, lead:
+            seconds between run() and the first event. """
+        self.dp = dp
+        self.sequence = sequence
+        self.sample_rate = sample_rate
+        self.profile = profile
+        self.lead = lead
+        self.compiled = []           # (offset s, settings), see prepare()
+        self.duration = 0.0
+        self.events = []             # (planned s, actual s, done s, settings, answer)
+        self.sample_times = []       # (planned s, actual s)
+        self.skipped_samples = 0
+        self.deferred_samples = 0
+        self.validations = 0
+
+    def prepare(self):
+        """ Activate the profile and compile the sequence from its
+            settings. Returns the active profile nr. """
+        if self.profile is not None:
+            self.dp.activate_profile(self.profile)
+        active = self.dp.get_active_profile_info()
+        if active is None:
+            raise OSError("no answer from the DP100")
+        self.compiled, self.duration = compile_sequence(self.sequence, active["vo_set"],
+                                                        active["io_set"])
+        return active["index"]
+
+    def apply(self, nr, settings):
+        """ One setpoint event, one write if the state cache is fresh
+            (output: the active profile is read first). """
+        if "output" in settings:
+            return self.dp.write_profile(nr, 0x20, state=settings["output"])
+        return self.dp.write_profile(nr, 0x40, vo_set=settings.get("vo_set"),
+                                     io_set=settings.get("io_set"))
+
+    def run(self, stop_event=None):
+        """ Run the sequence, blocking until it ends or stop_event is set.
+            Returns the report. """
+        nr = self.prepare()
+        stop_event = stop_event or threading.Event()
+        period = 1/self.sample_rate if self.sample_rate else None
+        transfer_time = 0.002        # running mean of one basic info read
+        start = monotonic() + self.lead
+        end = start + self.duration
+        position = 0
+        sample_slot = 0
+        deferred = None              # sample slot counted as deferred
+        while not stop_event.is_set():
+            now = monotonic()
+            next_event = start + self.compiled[position][0] if position < len(self.compiled) else None
+            next_sample = start + sample_slot*period if period is not None else None
+            if next_event is None and (next_sample is None or next_sample > end):
+                break
+            if next_sample is not None and next_sample < now - period:  # missed slots
+                missed = int((now - next_sample)/period)
+                self.skipped_samples += missed
+                sample_slot += missed
+                continue
+            if next_sample is not None and next_sample > end:
+                next_sample = None
+            # a sample may only start if it is done before the next setpoint
+            sample_fits = next_sample is not None and \
+                (next_event is None or next_sample + 2*transfer_time <= next_event)
+            due = next_sample if sample_fits else next_event
+            if not sample_fits and next_sample is not None and next_sample <= next_event \
+               and deferred != sample_slot:
+                self.deferred_samples += 1
+                deferred = sample_slot
+            if due > now and stop_event.wait(due - now):
+                break
+            if not sample_fits:
+                actual = monotonic()
+                try:
+                    answer = self.apply(nr, self.compiled[position][1])
+                except Exception as e:
+                    print(f"Error: {e}")
+                    answer = None
+                self.events.append((self.compiled[position][0], actual - start,
+                                    monotonic() - start, self.compiled[position][1], answer))
+                position += 1
+                continue
+            actual = monotonic()
+            started = perf_counter()
+            try:
+                basic_info = self.dp.read_basic_info()
+            except Exception as e:
+                print(f"Error: {e}")
+                basic_info = None
+            transfer_time += (perf_counter() - started - transfer_time)/8
+            if basic_info is not None:
+                self.dp.record_sample(actual, basic_info)
+                self.sample_times.append((next_sample - start, actual - start))
+            sample_slot += 1
+            # the cache goes stale after a while, confirm it in the gap
+            # so a setpoint stays one write
+            if not self.dp.state.fresh() and \
+               (next_event is None or monotonic() + 2*transfer_time < next_event):
+                self.dp.get_active_profile_info()
+                self.validations += 1
+        return self.report()
+
+    def report(self):
+        """ Planned versus actual timing of setpoints and samples. """
+        lateness = [actual - planned for planned, actual, _, _, _ in self.events]
+        durations = [done - actual for _, actual, done, _, _ in self.events]
+        sample_lateness = [actual - planned for planned, actual in self.sample_times]
+        return {"events": len(self.events), "planned_events": len(self.compiled),
+                "failed_events": sum(1 for event in self.events if event[4] != 1),
+                "duration_s": self.duration,
+                "setpoint_lateness": timing(lateness),
+                "setpoint_write": timing(durations),
+                "samples": len(self.sample_times),
+                "sample_lateness": timing(sample_lateness),
+                "skipped_samples": self.skipped_samples,
+                "deferred_samples": self.deferred_samples,
+                "cache_validations": self.validations}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a DP100 setpoint sequence")
+    parser.add_argument("sequence", help="JSON file with the list of steps")
+    parser.add_argument("--rate", type=float, default=10.0, metavar="HZ",
+                        help="telemetry samples per second during the sequence, 0 for none (default 10)")
+    parser.add_argument("--profile", type=int, metavar="NR",
+                        help="activate profile NR first, default the active one")
+    parser.add_argument("--report", metavar="FILE", help="also write the JSON report to FILE")
+    parser.add_argument("--emulator", action="store_true",
+                        help="use the software DP100 emulator instead of the USB device")
+    parser.add_argument("--emulator-latency", type=float, default=0.002, metavar="S",
+                        help="emulator response time in seconds (default 0.002)")
+    args = parser.parse_args()
+    with open(args.sequence) as file:
+        sequence = json.load(file)
+    session = None
+    if args.emulator:
+        session = DP100Session(VENDOR_ID, PRODUCT_ID,
+                               device_factory=DP100Emulator(latency=args.emulator_latency))
+    dp = DP100Functions(queue.Queue(), DiscardQueue(), queue.Queue(), session)
+    dp.get_device_info()             # starts the log
+    runner = SequenceRunner(dp, sequence, args.rate, args.profile)
+    stop_event = threading.Event()
+    try:
+        report = runner.run(stop_event)
+    except KeyboardInterrupt:
+        print("Keyboard interrupt by user")
+        report = runner.report()
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        dp.close()
+        return
+    dp.close()
+    text = json.dumps(report, indent=1)
+    if args.report:
+        with open(args.report, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""  DP100 HID session """
+
+import threading
+from time import monotonic
+import hid
+from dp100_protocol import response_matches
+from dp100_profile import NULL_PROFILER
+
+def enumerate_devices(vendor_id, product_id):
+    """ HID device dicts of all connected units (see hid.enumerate()),
+        one per path. """
+    devices = {}
+    for device_dict in hid.enumerate(vendor_id, product_id):
+        devices.setdefault(device_dict["path"], device_dict)
+    return list(devices.values())
+
+class DP100Session:
+    def __init__(self, vendor_id, product_id, device_factory=hid.device,
+                 timeout_ms=5000, serial_number=None, path=None, discovery=None):
+        """ Long-lived HID session owning one open handle to the DP100.
+            The handle is opened on first use and reopened transparently
+            if the device disappears (unplugged, power cycled). With
+            several units the device is chosen by HID serial number or
+            path, else the first one found is used. With a DeviceDiscovery
+            the device is opened by its cached path and transfers fail at
+            once while it is unplugged. """
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.serial_number = serial_number
+        self.path = path
+        self.device_factory = device_factory
+        self.timeout_ms = timeout_ms
+        self.device = None
+        self.lock = threading.RLock()  # one request/response pair at a time
+        self.connected = threading.Event()  # cleared while the unit is unplugged
+        self.profiler = NULL_PROFILER  # times HID write and read, see dp100_profile
+        self.stale_responses = 0     # late answers dropped, see _transfer()
+        self.discovery = discovery
+        if discovery is None:
+            self.connected.set()
+        else:
+            discovery.subscribe(self._on_change)
+            self._on_change(None, None)
+
+    def open(self):
+        """ Open the device if it is not already open. """
+        with self.lock:
+            if self.device is None:
+                device = self.device_factory()
+                try:
+                    if self.discovery is not None:
+                        device_dict = self.discovery.find(self.serial_number, self.path)
+                        if device_dict is None:
+                            raise OSError("DP100 not connected")
+                        device.open_path(device_dict["path"])
+                    elif self.path is not None:
+                        device.open_path(self.path)
+                    elif self.serial_number is not None:
+                        device.open(self.vendor_id, self.product_id, self.serial_number)
+                    else:
+                        device.open(self.vendor_id, self.product_id)
+                except Exception:
+                    device.close()
+                    raise
+                self.device = device
+            return self.device
+
+    def close(self):
+        """ Close the handle, the next transfer reopens it. """
+        with self.lock:
+            if self.device is not None:
+                try:
+                    self.device.close()
+                except Exception:
+                    pass
+                self.device = None
+
+    def is_open(self):
+        return self.device is not None
+
+    def _on_change(self, event, device_dict):
+        """ Discovery callback, tracks whether our unit is plugged in. """
+        if self.discovery.find(self.serial_number, self.path) is not None:
+            self.connected.set()
+        else:
+            self.connected.clear()
+
+    def wait_connected(self, timeout=None):
+        """ Wait until the unit is plugged in, True if it is. """
+        return self.connected.wait(timeout)
+
+    def transfer(self, request):
+        """ Send a 64-byte request and return the 64-byte response
+            (empty list on timeout). On an I/O error the handle is
+            dropped and the request is retried once on a fresh handle.
+            After a timeout the handle is closed too, so a late answer
+            can not be taken for the answer to the next request. """
+        with self.lock:
+            if not self.connected.is_set():
+                self.close()
+                raise OSError("DP100 not connected")
+            try:
+                return self._transfer(request)
+            except (OSError, ValueError):
+                self.close()                # device gone, reconnect
+            try:
+                return self._transfer(request)
+            except Exception:
+                self.close()
+                raise
+
+    def _transfer(self, request):
+        device = self.open()
+        with self.profiler.stage("hid_write"):
+            written = device.write(request)
+        if written < 0:
+            raise OSError("write error")
+        with self.profiler.stage("hid_read"):
+            deadline = monotonic() + self.timeout_ms/1000
+            while True:
+                timeout_ms = max(0, round((deadline - monotonic())*1000))
+                response = device.read(64, timeout_ms=timeout_ms)
+                if response and response_matches(request, response):
+                    return response
+                if response:
+                    self.stale_responses += 1   # late answer to an earlier request
+                if not response or timeout_ms == 0:
+                    self.close()
+                    return []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,109 @@
+"""  DP100 device state cache
+
+    Last known active profile, output state and settings of the 10
+    profiles, so control commands can write at once instead of reading the
+    profile first. Profile reads and successful writes update it. It is
+    cleared on errors and on changes made on the front panel, which show
+    up as a profile read (settings, active profile or its output state)
+    that differs from the cache. After max_age seconds without a read of
+    the active profile the cache is stale until one such read confirms
+    it again. """
+
+import threading
+from time import monotonic
+
+SETTINGS = ("vo_set", "io_set", "ovp_set", "ocp_set")
+
+class DeviceState:
+    def __init__(self, max_age=5.0):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.profiles = {}           # nr: profile dict as decoded by codec.PROFILE
+        self.active = None           # nr of the active profile
+        self.output = None           # 0/1, None if unknown
+        self.validated = None        # monotonic() of the last confirming read
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.profiles = {}
+            self.active = self.output = self.validated = None
+
+    def _fresh(self):
+        return self.validated is not None and monotonic() - self.validated < self.max_age
+
+    def fresh(self):
+        """ True if the cache was confirmed within max_age seconds. """
+        with self.lock:
+            return self._fresh()
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def profile(self, nr):
+        """ Copy of profile nr, None if unknown or stale. """
+        with self.lock:
+            profile = self.profiles.get(nr) if self._fresh() else None
+            return self._count(None if profile is None else dict(profile))
+
+    def all_profiles(self):
+        """ Copies of all 10 profiles {nr: profile}, None unless all are
+            known and fresh. """
+        with self.lock:
+            if not self._fresh() or len(self.profiles) < 10:
+                return self._count(None)
+            return self._count({nr: dict(profile) for nr, profile in self.profiles.items()})
+
+    def active_profile(self):
+        """ Copy of the active profile with the output state, None if
+            unknown or stale. """
+        with self.lock:
+            if not self._fresh() or self.active not in self.profiles or self.output is None:
+                return self._count(None)
+            return self._count({**self.profiles[self.active], "state": self.output})
+
+    def update(self, profile, active=False):
+        """ Store a profile read from the device (active: the answer to
+            the active profile request). A read that differs from the
+            cache means it was changed elsewhere, the rest is dropped. """
+        nr = profile["index"]
+        with self.lock:
+            cached = self.profiles.get(nr)
+            if cached is not None and any(cached[name] != profile[name] for name in SETTINGS) \
+               or active and self.active is not None and \
+               (self.active != nr or self.output not in (None, profile["state"])):
+                self.profiles = {}
+                self.active = self.output = self.validated = None
+            self.profiles[nr] = dict(profile)
+            if active:
+                self.active = nr
+                self.output = profile["state"]
+                self.validated = monotonic()
+
+    def update_all(self, profiles):
+        """ Store a fresh read of all 10 profiles. """
+        for profile in profiles.values():
+            self.update(profile)
+        if len(profiles) == 10:
+            with self.lock:
+                if self.active is not None:
+                    self.validated = monotonic()
+
+    def written(self, profile, command):
+        """ A profile write the device acknowledged, command 0x40 set,
+            0x20 switch output (state), 0xA0 activate. """
+        nr = profile["index"]
+        with self.lock:
+            self.profiles[nr] = dict(profile)
+            if command == 0x20:
+                self.active = nr
+                self.output = profile["state"]
+            elif command == 0xA0:
+                if self.active != nr:
+                    self.output = None       # read again to be sure
+                self.active = nr
@@ -1,5 +1,6 @@
 import hid
 from time import sleep
+import dp100_codec as codec
 
 def list_hid_devices():
     """
@@ -48,15 +49,7 @@ def get_basic_info():
         response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
         if len(response) == 64 and response[0] == 0xFA and response[1] == 0x30 \
             and response[2] == 0x00 and response[3] == 0x10:
-            basic_info["vin"] = (response[5]*255+response[4])/1000
-            basic_info["vout"] = (response[7]*255+response[6])/1000
-            basic_info["iout"] = (response[9]*255+response[8])/1000
-            basic_info["vo_max"] = (response[11]*255+response[10])/1000
-            basic_info["temp1"] = (response[13]*255+response[12])/10
-            basic_info["temp2"] = (response[15]*255+response[14])/10
-            basic_info["dc_5v"] = (response[17]*255+response[16])/1000
-            basic_info["mode_out"] = response[18]
-            basic_info["work_st"] = response[19]
+            basic_info = codec.BASIC_INFO.decode(response)
             return basic_info
         else:
             print("Invalid response received")
@@ -84,26 +77,7 @@ def get_device_info():
         response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
         if len(response) == 64 and response[0] == 0xFA and response[1] == 0x10 \
             and response[2] == 0x00 and response[3] == 0x28:
-            name=""
-            for i in range(4,20):
-                if response[i] == 0x00:
-                    break
-                else:
-                    name += chr(response[i])
-            device_info["name"] = name
-            device_info["h_version"] = (response[21]*255+response[20])/10
-            device_info["s_version"] = (response[23]*255+response[22])/10
-            device_info["boot_ver"] = (response[25]*255+response[24])/10
-            device_info["run area"] = (response[27]*255+response[26])/10
-            serial_number=""
-            for i in range(36, 40):
-                if response[i] < 16:
-                    serial_number+="0"
-                serial_number+=str(hex(response[i]))[2:]
-            device_info["serial_number"] = serial_number
-            device_info["year"] = response[41]*255+response[40]
-            device_info["month"] = response[42]
-            device_info["day"] = response[43]
+            device_info = codec.DEVICE_INFO.decode(response)
             return device_info
         else:
             print("Invalid response received")
@@ -130,12 +104,7 @@ def get_active_profile_info():
         response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
         if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
             and response[2] == 0x00 and response[3] == 0x0a:
-            parameter_info["index"] = response[4] # actual profile
-            parameter_info["state"] = response[5] # on/off
-            parameter_info["vo_set"] = (response[7]*255+response[6])/1000
-            parameter_info["io_set"] = (response[9]*255+response[8])/1000
-            parameter_info["ovp_set"] = (response[11]*255+response[10])/1000 # vmax
-            parameter_info["ocp_set"] = (response[13]*255+response[12])/1000 # imax
+            parameter_info = codec.PROFILE.decode(response)
             return parameter_info
         else:
             print("Invalid response received")
@@ -166,9 +135,7 @@ def get_profiles():
             response = device.read(64, timeout_ms=5000) # Read the resp. 5s timeout
             if len(response) == 64 and response[0] == 0xFA and response[1] == 0x35 \
                 and response[2] == 0x00 and response[3] == 0x0a:
-                list = [response[4], response[5], (response[7]*255+response[6])/1000,
-                        (response[9]*255+response[8])/1000, (response[11]*255+response[10])/1000,
-                        (response[13]*255+response[12])/1000]
+                list = [*codec.PROFILE.decode(response).values()]
                 profiles[i] = list
             else:
                 print("Invalid response received")
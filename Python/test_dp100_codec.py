@@ -0,0 +1,105 @@
+"""  DP100 frame tests
+
+    Pins the prebuilt requests to the hand-written frames of
+    hidapi_test_n.py and the codec to known 0x10/0x30/0x35 frames
+    (16-bit values little endian, high byte * 256).
+
+        python -m pytest -q test_dp100_codec.py
+"""
+
+import dp100_codec as codec
+import dp100_protocol as protocol
+
+# (CRC low, CRC high) of the profile read requests 0..9, from hidapi_test_n.py
+PROFILE_CRC = [(0xcf, 0x88), (0x0e, 0x48), (0x4e, 0x49), (0x8f, 0x89), (0xce, 0x4b),
+               (0x0f, 0x8b), (0x4f, 0x8a), (0x8e, 0x4a), (0xce, 0x4e), (0x0f, 0x8e)]
+
+def bitwise_crc16(buf):
+    crc = 0xFFFF
+    for byte in buf:
+        crc ^= byte
+        for bit in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+def frame(*head):
+    """ 64-byte frame starting with head. """
+    return bytes(head) + bytes(64 - len(head))
+
+def test_static_requests():
+    assert protocol.REQUEST_DEVICE_INFO == frame(0xfb, 0x10, 0x00, 0x00, 0x30, 0xc5)
+    assert protocol.REQUEST_BASIC_INFO == frame(0xfb, 0x30, 0x00, 0x00, 0x31, 0x0f)
+    assert protocol.REQUEST_ACTIVE_PROFILE == frame(0xfb, 0x35, 0x00, 0x01, 0x80, 0xce, 0x28)
+
+def test_profile_requests():
+    for nr, (low, high) in enumerate(PROFILE_CRC):
+        assert protocol.REQUEST_PROFILE[nr] == frame(0xfb, 0x35, 0x00, 0x01, nr, low, high)
+
+def test_crc_table():
+    data = bytes(range(256))*3
+    assert protocol.crc16(data) == bitwise_crc16(data)
+    assert protocol.crc16(data[100:], protocol.crc16(data[:100])) == bitwise_crc16(data)
+    assert protocol.modbus_crc([0xfb, 0x10, 0x00, 0x00]) == (0x30, 0xc5)
+
+def test_decode_device_info():
+    response = frame(0xfa, 0x10, 0x00, 0x28,
+                     *b"DP100", *bytes(11),          # name
+                     0x0b, 0x00,                     # hardware version 1.1
+                     0x02, 0x01,                     # software version 25.8
+                     0x0a, 0x00,                     # boot version 1.0
+                     0x0c, 0x00,                     # run area 1.2
+                     *bytes(8),
+                     0x12, 0x34, 0x56, 0x78,         # serial number
+                     0xe9, 0x07, 0x05, 0x01)         # 2025-05-01
+    assert codec.DEVICE_INFO.decode(response) == {
+        "name": "DP100", "h_version": 1.1, "s_version": 25.8, "boot_ver": 1.0,
+        "run_area": 1.2, "serial_number": "12345678", "year": 2025, "month": 5, "day": 1}
+
+def test_decode_basic_info():
+    response = frame(0xfa, 0x30, 0x00, 0x10,
+                     0x20, 0x4e,                     # vin 20.0 V
+                     0x88, 0x13,                     # vout 5.0 V
+                     0xf4, 0x01,                     # iout 0.5 A
+                     0x5c, 0x4a,                     # vo_max 19.036 V
+                     0xfa, 0x00,                     # temp1 25.0 °C
+                     0xff, 0x00,                     # temp2 25.5 °C
+                     0x88, 0x13,                     # dc 5V 5.0 V
+                     0x01, 0x02)                     # mode_out, work_st
+    assert codec.BASIC_INFO.decode(response) == {
+        "vin": 20.0, "vout": 5.0, "iout": 0.5, "vo_max": 19.036, "temp1": 25.0,
+        "temp2": 25.5, "dc_5v": 5.0, "mode_out": 1, "work_st": 2}
+
+def test_decode_profile():
+    response = frame(0xfa, 0x35, 0x00, 0x0a,
+                     0x02, 0x01,                     # profile 2, on
+                     0xcc, 0x10,                     # vo_set 4.3 V
+                     0xf4, 0x01,                     # io_set 0.5 A
+                     0x24, 0x77,                     # ovp_set 30.5 V
+                     0xba, 0x13)                     # ocp_set 5.05 A
+    assert codec.PROFILE.decode(response) == {
+        "index": 2, "state": 1, "vo_set": 4.3, "io_set": 0.5, "ovp_set": 30.5, "ocp_set": 5.05}
+
+def test_decode_rejects_other_frames():
+    assert codec.BASIC_INFO.decode(protocol.REQUEST_BASIC_INFO) is None   # request header
+    assert codec.PROFILE.decode(frame(0xfa, 0x35, 0x00, 0x01, 0x01)) is None  # write ack
+    assert codec.DEVICE_INFO.decode([]) is None
+
+def test_encode_profile():
+    request = codec.encode_profile(bytearray(64), 0x40 + 2, 1, 4.3, 0.5, 30.5, 5.05)
+    head = [0xfb, 0x35, 0x00, 0x0a, 0x42, 0x01, 0xcc, 0x10, 0xf4, 0x01, 0x24, 0x77, 0xba, 0x13]
+    crc = bitwise_crc16(head)
+    assert bytes(request) == frame(*head, crc & 0xFF, crc >> 8)
+
+def test_response_matches():
+    ack = frame(0xfa, 0x35, 0x00, 0x01, 0x01)
+    profile_2 = frame(0xfa, 0x35, 0x00, 0x0a, 0x02)
+    write = codec.encode_profile(bytearray(64), 0x40 + 2, 1, 4.3, 0.5, 30.5, 5.05)
+    assert protocol.response_matches(protocol.REQUEST_PROFILE[2], profile_2)
+    assert protocol.response_matches(protocol.REQUEST_ACTIVE_PROFILE, profile_2)
+    assert not protocol.response_matches(protocol.REQUEST_PROFILE[3], profile_2)
+    assert not protocol.response_matches(protocol.REQUEST_PROFILE[2], ack)
+    assert not protocol.response_matches(protocol.REQUEST_BASIC_INFO, profile_2)
+    assert protocol.response_matches(write, ack)
+    assert not protocol.response_matches(write, profile_2)
+    assert protocol.write_ack(ack) == 1
+    assert protocol.write_ack(profile_2) is None
@@ -0,0 +1,77 @@
+"""  DP100 profile sync tests
+
+    sync_profiles() against the emulator: transfers needed, read back
+    and argument checks.
+
+        python -m pytest -q test_dp100_functions.py
+"""
+
+import pytest
+from dp100_functions import DP100Functions, DiscardQueue
+from dp100_session import DP100Session
+from dp100_emulator import DP100Emulator
+from dp100_protocol import VENDOR_ID, PRODUCT_ID
+
+def connect(emulator):
+    """ DP100Functions on the emulator with a fresh state cache, and the
+        list of requests sent from then on. """
+    session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=emulator)
+    dp = DP100Functions(DiscardQueue(), DiscardQueue(), DiscardQueue(), session, library=True)
+    dp.get_active_profile_info()
+    dp.get_profiles()
+    requests = []
+    transfer = session.transfer
+    def counting(request):
+        requests.append(bytes(request[:5]))
+        return transfer(request)
+    session.transfer = counting
+    return dp, requests
+
+def test_sync_unchanged():
+    emulator = DP100Emulator()
+    dp, requests = connect(emulator)
+    desired = {nr: {"vo_set": vo_set, "io_set": io_set}
+               for nr, (vo_set, io_set, _, _) in enumerate(emulator.profiles)}
+    result = dp.sync_profiles(desired)
+    assert requests == []
+    assert result["changed"] == [] and result["failed"] == []
+
+def test_sync_two_profiles():
+    emulator = DP100Emulator()
+    dp, requests = connect(emulator)
+    result = dp.sync_profiles({2: {"vo_set": 3.3}, 6: {"io_set": 0.25, "ocp_set": 0.5}})
+    assert [request[4] for request in requests] == [0x42, 0x46, 0x02, 0x06]  # write, read back
+    assert result["changed"] == [2, 6] and result["failed"] == []
+    assert emulator.profiles[2][0] == 3.3
+    assert emulator.profiles[6][1:] == [0.25, 30.5, 0.5]
+    assert result["profiles"][6]["ocp_set"] == 0.5
+
+def test_sync_verify_fails():
+    emulator = DP100Emulator()
+    dp, requests = connect(emulator)
+    write_profile = emulator.write_profile
+    def forgetful(request):                     # acknowledges, keeps the old values
+        settings = list(emulator.profiles[4])
+        answer = write_profile(request)
+        emulator.profiles[4] = settings
+        return answer
+    emulator.write_profile = forgetful
+    result = dp.sync_profiles({4: {"vo_set": 9.0}, 5: {"vo_set": 1.5}})
+    assert result["changed"] == [4, 5] and result["failed"] == [4]
+    assert result["profiles"][4]["vo_set"] == 1.8 and result["profiles"][5]["vo_set"] == 1.5
+    assert dp.sync_profiles({4: {"vo_set": 9.0}}, verify=False)["failed"] == []
+
+def test_sync_reads_stale_cache():
+    emulator = DP100Emulator()
+    dp, requests = connect(emulator)
+    dp.state.invalidate()
+    assert dp.sync_profiles({0: {"vo_set": 2.0}}, verify=False)["changed"] == [0]
+    assert len(requests) == 11                  # 10 reads, 1 write
+
+def test_sync_rejects_bad_arguments():
+    dp, requests = connect(DP100Emulator())
+    with pytest.raises(ValueError):
+        dp.sync_profiles({10: {"vo_set": 5.0}})
+    with pytest.raises(ValueError):
+        dp.sync_profiles({1: {"ovp": 5.0}})
+    assert requests == []
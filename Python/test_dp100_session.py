@@ -0,0 +1,81 @@
+"""  DP100 session tests
+
+    Retry, reconnect and the read loop of DP100Session with a scripted
+    stand-in for hid.device.
+
+        python -m pytest -q test_dp100_session.py
+"""
+
+import pytest
+from dp100_session import DP100Session
+from dp100_protocol import VENDOR_ID, PRODUCT_ID, REQUEST_BASIC_INFO, REQUEST_PROFILE
+
+BASIC_INFO = [0xfa, 0x30, 0x00, 0x10] + [0]*60
+PROFILE_3 = [0xfa, 0x35, 0x00, 0x0a, 0x03] + [0]*59
+
+class FakeDevice:
+    """ hid.device answering reads from a list (a missing or empty
+        answer is a timeout), write raises the errors in write_errors
+        one after the other. """
+    def __init__(self, answers=(), write_errors=()):
+        self.answers = list(answers)
+        self.write_errors = list(write_errors)
+        self.opened = 0
+        self.closed = 0
+        self.writes = 0
+
+    def open(self, vendor_id, product_id, serial_number=None):
+        self.opened += 1
+
+    def close(self):
+        self.closed += 1
+
+    def write(self, data):
+        self.writes += 1
+        if self.write_errors:
+            raise self.write_errors.pop(0)
+        return len(data)
+
+    def read(self, max_length, timeout_ms=0):
+        return self.answers.pop(0) if self.answers else []
+
+def session(device):
+    return DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=lambda: device, timeout_ms=50)
+
+def test_stale_response_then_timeout():
+    device = FakeDevice([PROFILE_3])
+    dp = session(device)
+    assert dp.transfer(REQUEST_BASIC_INFO) == []
+    assert dp.stale_responses == 1
+    assert not dp.is_open() and device.closed == 1
+
+def test_stale_response_dropped():
+    device = FakeDevice([PROFILE_3, BASIC_INFO])
+    dp = session(device)
+    assert dp.transfer(REQUEST_BASIC_INFO) == BASIC_INFO
+    assert dp.stale_responses == 1 and dp.is_open()
+    device.answers = [PROFILE_3]
+    assert dp.transfer(REQUEST_PROFILE[3]) == PROFILE_3
+
+@pytest.mark.parametrize("error", [OSError("write error"), ValueError("not open")])
+def test_retry_once(error):
+    device = FakeDevice([BASIC_INFO], write_errors=[error])
+    dp = session(device)
+    assert dp.transfer(REQUEST_BASIC_INFO) == BASIC_INFO
+    assert (device.writes, device.opened, device.closed) == (2, 2, 1)
+
+def test_second_error_raised():
+    device = FakeDevice(write_errors=[OSError("gone"), OSError("still gone")])
+    dp = session(device)
+    with pytest.raises(OSError):
+        dp.transfer(REQUEST_BASIC_INFO)
+    assert device.writes == 2 and not dp.is_open()
+
+def test_reconnect_after_close():
+    device = FakeDevice([BASIC_INFO, BASIC_INFO])
+    dp = session(device)
+    assert dp.transfer(REQUEST_BASIC_INFO) == BASIC_INFO
+    dp.close()
+    assert not dp.is_open()
+    assert dp.transfer(REQUEST_BASIC_INFO) == BASIC_INFO
+    assert dp.is_open() and device.opened == 2
@@ -0,0 +1,108 @@
+"""  DP100 state cache tests
+
+    DeviceState and the transfers DP100Functions saves with it, against
+    the emulator. A front panel change is the emulator's active profile
+    or output changed behind the cache.
+
+        python -m pytest -q test_dp100_state.py
+"""
+
+from dp100_functions import DP100Functions, DiscardQueue
+from dp100_session import DP100Session
+from dp100_emulator import DP100Emulator
+from dp100_protocol import VENDOR_ID, PRODUCT_ID
+from dp100_state import DeviceState
+
+def profile(nr, state=0, vo_set=5.0, io_set=1.0):
+    return {"index": nr, "state": state, "vo_set": vo_set, "io_set": io_set,
+            "ovp_set": 30.5, "ocp_set": 5.05}
+
+def connect(emulator=None):
+    """ DP100Functions on the emulator with all profiles and the active
+        one read, and the list of requests sent from then on. """
+    emulator = emulator or DP100Emulator()
+    session = DP100Session(VENDOR_ID, PRODUCT_ID, device_factory=emulator)
+    dp = DP100Functions(DiscardQueue(), DiscardQueue(), DiscardQueue(), session, library=True)
+    dp.get_profiles()
+    dp.get_active_profile_info()
+    requests = []
+    transfer = session.transfer
+    def counting(request):
+        requests.append(bytes(request[:5]))
+        return transfer(request)
+    session.transfer = counting
+    return dp, emulator, requests
+
+def test_update_and_written():
+    state = DeviceState()
+    state.update(profile(2, state=1), active=True)
+    assert state.fresh()
+    assert state.active_profile() == profile(2, state=1)
+    state.written(profile(2, vo_set=3.3), 0x40)
+    assert state.profile(2)["vo_set"] == 3.3
+    state.written(profile(4, state=1), 0x20)
+    assert (state.active, state.output) == (4, 1)
+    state.written(profile(6), 0xA0)
+    assert state.active == 6 and state.active_profile() is None  # output unknown
+    state.invalidate()
+    assert not state.fresh() and state.profile(4) is None
+
+def test_stale_after_max_age():
+    state = DeviceState(max_age=0.0)
+    state.update(profile(2), active=True)
+    assert state.profile(2) is None and state.misses == 1
+
+def test_differing_read_drops_cache():
+    state = DeviceState()
+    state.update(profile(2, state=1), active=True)
+    state.update(profile(3))
+    state.update(profile(3, vo_set=12.0))       # changed on the front panel
+    assert state.profile(2) is None and not state.fresh()
+    state.update(profile(2, state=1), active=True)
+    state.update(profile(5, state=1), active=True)  # other profile active
+    assert state.profile(2) is None and state.active == 5
+
+def test_transfer_counts():
+    dp, emulator, requests = connect()
+    assert dp.on_off() == 1                     # active profile read, switch
+    assert len(requests) == 2 and emulator.output == 1
+    assert dp.off() == 1                        # active profile read, switch
+    assert len(requests) == 4 and emulator.output == 0
+    del requests[:]
+    assert dp.change_profile(3, 7.5, 0.25) == 1  # fresh cache, no read first
+    assert requests == [bytes([0xfb, 0x35, 0x00, 0x0a, 0x43])]
+    assert emulator.profiles[3][:2] == [7.5, 0.25]
+
+def test_off_after_front_panel_change():
+    dp, emulator, requests = connect()
+    assert dp.state.fresh() and dp.state.active == 0
+    emulator.active, emulator.output = 5, 1     # within the cache age
+    assert dp.off() == 1
+    assert (emulator.active, emulator.output) == (5, 0)
+    assert requests[-1] == bytes([0xfb, 0x35, 0x00, 0x0a, 0x25])
+
+def test_activate_after_front_panel_change():
+    dp, emulator, requests = connect()
+    emulator.profiles[7] = [9.0, 0.5, 30.5, 5.05]
+    emulator.active, emulator.output = 7, 1
+    assert dp.activate_profile(2) == 1
+    assert emulator.active == 2 and emulator.profiles[7] == [9.0, 0.5, 30.5, 5.05]
+    # the changed active profile dropped the cache, profile 2 is read again
+    assert [request[4] for request in requests] == [0x80, 0x02, 0xa2]
+    assert dp.state.profile(7)["vo_set"] == 9.0
+
+def test_timeout_invalidates():
+    dp, emulator, requests = connect(DP100Emulator(latency=0.05))
+    dp.session.timeout_ms = 10
+    assert dp.read_basic_info() is None
+    assert not dp.state.fresh() and dp.state.profile(0) is None
+    assert not dp.session.is_open()
+
+def test_invalid_response_invalidates():
+    dp, emulator, requests = connect()
+    handle_request = emulator.handle_request
+    emulator.handle_request = lambda request: bytes([0xfa, 0x30, 0x00, 0x01]) + bytes(60)
+    assert dp.read_basic_info() is None
+    assert dp.state.profile(0) is None and not dp.session.is_open()
+    emulator.handle_request = handle_request
+    assert dp.read_basic_info() is not None     # reopens